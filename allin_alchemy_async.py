@@ -0,0 +1,160 @@
+# Асинхронная версия allin_alchemy: те же операции с таблицей users,
+# но через create_async_engine и AsyncSession (драйвер asyncpg).
+# Пока запрос ждет ответа базы, цикл событий выполняет другие задачи,
+# поэтому код можно встраивать в асинхронные сервисы без блокировок.
+#
+# Запуск демонстрации параллельной работы:
+#     python allin_alchemy_async.py --operations 500 --concurrency 50 --pool-size 5
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+# Модель общая с синхронной версией, настройки подключения - из .env (db_engine.py)
+from allin_alchemy import Base, User, USERS_SCHEMA_VERSION
+from db_engine import database_url, make_async_engine, print_pool_stats
+from schema_cache import ensure_schema, is_verified
+
+
+def init_engine(pool_size=5, max_overflow=0):
+    """
+    Создает асинхронный движок SQLAlchemy
+    pool_size - сколько соединений держит пул
+    max_overflow - сколько дополнительных соединений можно открыть сверх pool_size
+    Остальные настройки пула берутся из окружения (см. db_engine.py)
+    """
+    # postgresql+asyncpg - тот же PostgreSQL, но через асинхронный драйвер asyncpg
+    return make_async_engine(database_url("postgresql+asyncpg"),
+                             pool_size=pool_size, max_overflow=max_overflow)
+
+
+def make_session_factory(engine):
+    """
+    Фабрика асинхронных сессий
+    expire_on_commit=False: после commit атрибуты объектов можно читать
+    без повторного (неявного) запроса к базе
+    """
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def create_table(engine):
+    """Создает таблицу users, если она еще не проверена в этом процессе"""
+    if is_verified(User.__tablename__, USERS_SCHEMA_VERSION):
+        return
+    async with engine.begin() as conn:
+        # DDL в SQLAlchemy синхронный, поэтому выполняем его через run_sync
+        await conn.run_sync(lambda sync_conn: ensure_schema(
+            sync_conn.connection, User.__tablename__, USERS_SCHEMA_VERSION,
+            lambda: Base.metadata.create_all(sync_conn), persist=False))
+
+
+async def add_user(session, name):
+    """Добавляет пользователя и возвращает его ID"""
+    new_user = User(name=name)
+    session.add(new_user)
+    await session.commit()
+    return new_user.id
+
+
+async def delete_user(session, user_id):
+    """Удаляет пользователя одним запросом, возвращает True, если он был найден"""
+    result = await session.execute(delete(User).where(User.id == user_id))
+    await session.commit()
+    return result.rowcount > 0
+
+
+async def list_users(session):
+    """Возвращает список кортежей (id, name), отсортированный по ID"""
+    result = await session.execute(select(User.id, User.name).order_by(User.id))
+    return result.all()
+
+
+async def find_user(session, user_id):
+    """Возвращает кортеж (id, name) или None"""
+    user = await session.get(User, user_id)
+    return (user.id, user.name) if user else None
+
+
+async def update_user(session, user_id, new_name):
+    """Меняет имя пользователя, возвращает старое имя или None, если пользователь не найден"""
+    user = await session.get(User, user_id)
+    if user is None:
+        return None
+    old_name = user.name
+    user.name = new_name
+    await session.commit()
+    return old_name
+
+
+async def user_lifecycle(session_factory, number):
+    """Один сценарий демонстрации: добавить, найти, переименовать и удалить пользователя"""
+    async with session_factory() as session:
+        user_id = await add_user(session, f"async_demo_{number}")
+        await find_user(session, user_id)
+        await update_user(session, user_id, f"async_demo_{number}_renamed")
+        await delete_user(session, user_id)
+
+
+async def run_demo(operations, concurrency, pool_size):
+    """
+    Выполняет operations сценариев сначала по очереди, затем параллельно
+    (не больше concurrency одновременно) и сравнивает время.
+    Параллельных задач больше, чем соединений в пуле: лишние ждут
+    свободное соединение, не блокируя цикл событий.
+    """
+    engine = init_engine(pool_size=pool_size)
+    session_factory = make_session_factory(engine)
+    try:
+        await create_table(engine)
+
+        # По очереди: каждая операция ждет завершения предыдущей
+        started = time.perf_counter()
+        for number in range(operations):
+            await user_lifecycle(session_factory, number)
+        sequential = time.perf_counter() - started
+
+        # Параллельно: семафор ограничивает число одновременных сценариев
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(number):
+            async with semaphore:
+                await user_lifecycle(session_factory, number)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(number) for number in range(operations)))
+        parallel = time.perf_counter() - started
+
+        # В каждом сценарии 4 операции
+        total = operations * 4
+        print(f"Сценариев: {operations}, операций: {total}, соединений в пуле: {pool_size}")
+        print(f"По очереди: {sequential:.2f} с ({total / sequential:.0f} операций/с)")
+        print(f"Параллельно (до {concurrency} одновременно): {parallel:.2f} с "
+              f"({total / parallel:.0f} операций/с)")
+        print_pool_stats(engine)
+    finally:
+        await engine.dispose()
+
+
+def parse_args():
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Демонстрация асинхронной работы с таблицей users")
+    parser.add_argument("--operations", type=int, default=200, help="число сценариев")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="сколько сценариев выполнять одновременно")
+    parser.add_argument("--pool-size", type=int, default=5, help="размер пула соединений")
+    return parser.parse_args()
+
+
+def main():
+    """Главная функция: запускает демонстрацию"""
+    args = parse_args()
+    try:
+        asyncio.run(run_demo(args.operations, args.concurrency, args.pool_size))
+    except Exception as e:
+        print(f"Критическая ошибка: {e}")
+
+
+if __name__ == "__main__":
+    main()
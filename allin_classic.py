@@ -1,23 +1,135 @@
+import argparse
+import os
+import sys
+from contextlib import redirect_stdout
+
 import psycopg2
 from psycopg2 import sql
 
-# Настройки подключения
-DB_NAME = "Test"
-DB_USER = "postgres"
-DB_PASSWORD = "Postgres9724"
-DB_HOST = "localhost"
-DB_PORT = "5432"
+import db_pool
+from command_runner import DEFAULT_GROUP_SIZE, open_script, run_commands
+from get_all_users import iter_users
+from name_search import DEFAULT_LIMIT, FUZZY, PREFIX, search_users
+from pagination import browse_pages
+from prepared import StatementRegistry
+from schema_cache import ensure_schema
+
+# Сколько пользователей показывать на одной странице списка
+PAGE_SIZE = 20
+
+# Версия DDL таблицы users; увеличьте ее при изменении CREATE TABLE
+USERS_SCHEMA_VERSION = 1
+
+# Подготовленные запросы можно отключить переменной окружения DB_PREPARED_STATEMENTS=0
+USE_PREPARED = os.getenv("DB_PREPARED_STATEMENTS", "1") == "1"
+
+# Запросы CRUD-операций: готовятся один раз на соединение и выполняются через EXECUTE
+STATEMENTS = StatementRegistry({
+    "users_insert": "INSERT INTO users (name) VALUES ($1) RETURNING id",
+    "users_delete": "DELETE FROM users WHERE id = $1 RETURNING id",
+    "users_find": "SELECT id, name FROM users WHERE id = $1",
+    # Старое имя читается и новое записывается одним запросом;
+    # $3 - ожидаемое текущее имя (NULL - не проверять)
+    "users_rename": """
+        WITH old AS (
+            SELECT id, name FROM users WHERE id = $1 FOR UPDATE
+        ), updated AS (
+            UPDATE users AS u
+            SET name = $2
+            FROM old
+            WHERE u.id = old.id
+              AND ($3::varchar IS NULL OR old.name = $3)
+            RETURNING u.id
+        )
+        SELECT old.name, EXISTS (SELECT 1 FROM updated) FROM old
+    """,
+}, enabled=USE_PREPARED)
 
 
 def get_connection():
-    """Устанавливает соединение с базой данных"""
-    return psycopg2.connect(
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        host=DB_HOST,
-        port=DB_PORT
-    )
+    """
+    Берет соединение из общего пула (настройки подключения - в .env)
+    Использование: with get_connection() as conn: ...
+    """
+    return db_pool.connection()
+
+
+def insert_user(conn, name, commit=True):
+    """
+    Добавляет пользователя и возвращает его ID
+    commit - фиксировать ли транзакцию (False - фиксирует вызывающий код)
+    """
+    with conn.cursor() as cursor:
+        STATEMENTS.execute(cursor, "users_insert", (name,))
+        user_id = cursor.fetchone()[0]
+    if commit:
+        conn.commit()
+    return user_id
+
+
+def remove_user(conn, user_id, commit=True):
+    """Удаляет пользователя, возвращает True, если он был найден"""
+    with conn.cursor() as cursor:
+        STATEMENTS.execute(cursor, "users_delete", (user_id,))
+        result = cursor.fetchone()
+    if commit:
+        conn.commit()
+    return result is not None
+
+
+def get_user(conn, user_id):
+    """Возвращает (id, name) пользователя или None"""
+    with conn.cursor() as cursor:
+        STATEMENTS.execute(cursor, "users_find", (user_id,))
+        return cursor.fetchone()
+
+
+def rename_user(conn, user_id, new_name, expected_name=None, commit=True):
+    """
+    Меняет имя пользователя одним запросом и возвращает старое имя
+    expected_name - если задано, имя меняется только если в базе все еще это значение
+    Возвращает None, если пользователя нет, иначе (старое имя, обновлено ли имя)
+    """
+    with conn.cursor() as cursor:
+        STATEMENTS.execute(cursor, "users_rename", (user_id, new_name, expected_name))
+        result = cursor.fetchone()
+    if commit:
+        conn.commit()
+    return result
+
+
+class ScriptBackend:
+    """Операции для пакетного режима (command_runner.py) на одном соединении"""
+
+    errors = (psycopg2.Error,)
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def add(self, name):
+        return {"id": insert_user(self.conn, name, commit=False)}
+
+    def delete(self, user_id):
+        return {"deleted": remove_user(self.conn, user_id, commit=False)}
+
+    def update(self, user_id, new_name):
+        result = rename_user(self.conn, user_id, new_name, commit=False)
+        return {"found": result is not None, "old_name": result[0] if result else None}
+
+    def find(self, user_id):
+        user = get_user(self.conn, user_id)
+        return {"user": list(user) if user else None}
+
+    def list(self):
+        # Серверный курсор: строки читаются порциями, по порядку ID
+        # (как в allin_alchemy.ScriptBackend)
+        return iter_users(self.conn, "users", order_by_id=True)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
 
 
 def print_menu():
@@ -26,15 +138,17 @@ def print_menu():
     print("1. Создать/проверить таблицу users")
     print("2. Добавить пользователя")
     print("3. Удалить пользователя")
-    print("4. Показать всех пользователей")
+    print("4. Показать пользователей (постранично)")
     print("5. Найти пользователя по ID")
     print("6. Обновить имя пользователя")
+    print("7. Статистика пула соединений")
+    print("8. Найти пользователей по имени")
     print("0. Выход")
 
 
 def create_table(conn):
     """1. Создает таблицу users если она не существует"""
-    try:
+    def create():
         with conn.cursor() as cursor:
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS users (
@@ -42,8 +156,12 @@ def create_table(conn):
                     name VARCHAR(100) NOT NULL
                 );
             """)
-            conn.commit()
-            print("✓ Таблица 'users' готова к работе")
+        conn.commit()
+
+    try:
+        # DDL выполняется только при первой проверке (или при смене версии)
+        ensure_schema(conn, "users", USERS_SCHEMA_VERSION, create)
+        print("✓ Таблица 'users' готова к работе")
     except psycopg2.Error as e:
         print(f"Ошибка создания таблицы: {e}")
         conn.rollback()
@@ -57,14 +175,8 @@ def add_user(conn):
         return
 
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "INSERT INTO users (name) VALUES (%s) RETURNING id;",
-                (name,)
-            )
-            user_id = cursor.fetchone()[0]
-            conn.commit()
-            print(f"✓ Пользователь '{name}' добавлен с ID {user_id}")
+        user_id = insert_user(conn, name)
+        print(f"✓ Пользователь '{name}' добавлен с ID {user_id}")
     except psycopg2.Error as e:
         print(f"Ошибка добавления: {e}")
         conn.rollback()
@@ -78,46 +190,22 @@ def delete_user(conn):
         return
 
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "DELETE FROM users WHERE id = %s RETURNING id;",
-                (int(user_id),)
-            )
-            result = cursor.fetchone()
-            conn.commit()
-
-            if result:
-                print(f"✓ Пользователь с ID {user_id} удален")
-            else:
-                print(f"Пользователь с ID {user_id} не найден")
+        if remove_user(conn, int(user_id)):
+            print(f"✓ Пользователь с ID {user_id} удален")
+        else:
+            print(f"Пользователь с ID {user_id} не найден")
     except psycopg2.Error as e:
         print(f"Ошибка удаления: {e}")
         conn.rollback()
 
 
 def list_users(conn):
-    """4. Выводит список всех пользователей"""
+    """4. Выводит список пользователей постранично"""
     try:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT id, name FROM users ORDER BY id;")
-            users = cursor.fetchall()
-
-            if not users:
-                print("В таблице нет пользователей")
-                return
-
-            print("\nСписок пользователей:")
-            print("+" + "-" * 23 + "+")
-            print("| {:^3} | {:^15} |".format("ID", "Имя"))
-            print("+" + "-" * 23 + "+")
-
-            for user in users:
-                print("| {:^3} | {:<15} |".format(user[0], user[1]))
-
-            print("+" + "-" * 23 + "+")
-            print(f"Всего: {len(users)} пользователей")
+        browse_pages(conn, "users", PAGE_SIZE)
     except psycopg2.Error as e:
         print(f"Ошибка получения списка: {e}")
+        conn.rollback()
 
 
 def find_user(conn):
@@ -128,19 +216,13 @@ def find_user(conn):
         return
 
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(
-                "SELECT id, name FROM users WHERE id = %s;",
-                (int(user_id),)
-            )
-            user = cursor.fetchone()
-
-            if user:
-                print(f"\nНайден пользователь:")
-                print("ID:", user[0])
-                print("Имя:", user[1])
-            else:
-                print(f"Пользователь с ID {user_id} не найден")
+        user = get_user(conn, int(user_id))
+        if user:
+            print(f"\nНайден пользователь:")
+            print("ID:", user[0])
+            print("Имя:", user[1])
+        else:
+            print(f"Пользователь с ID {user_id} не найден")
     except psycopg2.Error as e:
         print(f"Ошибка поиска: {e}")
 
@@ -158,65 +240,118 @@ def update_user(conn):
         return
 
     try:
-        with conn.cursor() as cursor:
-            # Сначала проверим существование пользователя
-            cursor.execute(
-                "SELECT name FROM users WHERE id = %s FOR UPDATE;",
-                (int(user_id),)
-            )
-            result = cursor.fetchone()
-
-            if not result:
-                print(f"Пользователь с ID {user_id} не найден")
-                return
-
-            old_name = result[0]
-            cursor.execute(
-                "UPDATE users SET name = %s WHERE id = %s;",
-                (new_name, int(user_id)))
-            conn.commit()
-            print(f"✓ Имя пользователя с ID {user_id} изменено с '{old_name}' на '{new_name}'")
+        result = rename_user(conn, int(user_id), new_name)
+        if result is None:
+            print(f"Пользователь с ID {user_id} не найден")
+            return
+
+        old_name, _ = result
+        print(f"✓ Имя пользователя с ID {user_id} изменено с '{old_name}' на '{new_name}'")
     except psycopg2.Error as e:
         print(f"Ошибка обновления: {e}")
         conn.rollback()
 
 
+def find_by_name(conn):
+    """8. Ищет пользователей по началу имени или нечетко (по триграммам)"""
+    query = input("Введите имя или его часть: ").strip()
+    if not query:
+        print("Строка поиска не может быть пустой!")
+        return
+
+    mode = input("Искать по началу имени (1) или нечетко (2)? [1]: ").strip()
+    mode = FUZZY if mode == "2" else PREFIX
+
+    try:
+        users = search_users(conn, "users", query, mode, DEFAULT_LIMIT)
+        if not users:
+            print(f"Пользователи по запросу '{query}' не найдены")
+            return
+
+        print(f"\nНайдено (не больше {DEFAULT_LIMIT}):")
+        for user_id, name in users:
+            print(f"{user_id:>6}  {name}")
+    except psycopg2.Error as e:
+        print(f"Ошибка поиска: {e}")
+        conn.rollback()
+
+
+def run_script(path, group_size):
+    """Выполняет команды из файла (или stdin, если path = "-") без меню"""
+    with get_connection() as conn:
+        # stdout занят результатами в JSON - сообщения меню уводим в stderr
+        with redirect_stdout(sys.stderr):
+            create_table(conn)
+        with open_script(path) as lines:
+            summary = run_commands(lines, ScriptBackend(conn), group_size)
+    return summary["failed"] == 0
+
+
+def parse_args():
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Операции с таблицей users на psycopg2")
+    parser.add_argument("--script", help="выполнить команды из файла ('-' - stdin) "
+                                         "вместо меню, см. command_runner.py")
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE,
+                        help="сколько изменений фиксировать одной транзакцией")
+    return parser.parse_args()
+
+
 def main():
     """Главная функция"""
-    conn = None
+    args = parse_args()
+    if args.script:
+        try:
+            ok = run_script(args.script, args.group_size)
+        except (psycopg2.Error, OSError) as e:
+            print(f"Ошибка: {e}", file=sys.stderr)
+            ok = False
+        finally:
+            db_pool.close_pool()
+        sys.exit(0 if ok else 1)
+
     try:
-        conn = get_connection()
+        db_pool.get_pool()
         print("✓ Подключение к PostgreSQL установлено")
 
         while True:
             print_menu()
-            choice = input("Ваш выбор (0-6): ").strip()
+            choice = input("Ваш выбор (0-8): ").strip()
 
             if choice == "0":
                 break
             elif choice == "1":
-                create_table(conn)
+                action = create_table
             elif choice == "2":
-                add_user(conn)
+                action = add_user
             elif choice == "3":
-                delete_user(conn)
+                action = delete_user
             elif choice == "4":
-                list_users(conn)
+                action = list_users
             elif choice == "5":
-                find_user(conn)
+                action = find_user
             elif choice == "6":
-                update_user(conn)
+                action = update_user
+            elif choice == "7":
+                db_pool.print_pool_stats()
+                continue
+            elif choice == "8":
+                action = find_by_name
             else:
                 print("Неверный выбор, попробуйте снова")
+                continue
+
+            # Соединение берется из пула только на время операции
+            with get_connection() as conn:
+                action(conn)
     except psycopg2.Error as e:
         print(f"Ошибка подключения к базе данных: {e}")
     except Exception as e:
         print(f"Неизвестная ошибка: {e}")
     finally:
-        if conn:
-            conn.close()
-            print("✓ Соединение с базой данных закрыто")
+        db_pool.close_pool()
+        print("✓ Соединение с базой данных закрыто")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
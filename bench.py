@@ -0,0 +1,368 @@
+# Сравнение производительности allin_classic (psycopg2) и allin_alchemy (ORM)
+#
+# Для каждой реализации выполняются одни и те же операции с таблицей users:
+#   add    - добавить --rows пользователей
+#   find   - найти каждого по ID
+#   update - переименовать каждого
+#   list   - прочитать всю таблицу по порядку ID (--list-repeats раз)
+#   delete - удалить добавленных пользователей
+# Операции распределяются между --concurrency потоками, у каждого потока свое
+# соединение (сессия). Для каждой операции выводятся операций/с, задержки
+# p50/p95/p99 и пик памяти Python (tracemalloc), результаты сохраняются в JSON,
+# чтобы сравнивать их между версиями.
+#
+# Примеры:
+#     python bench.py --start-postgres --rows 2000 --concurrency 4
+#     python bench.py --rows 500 --impl classic --output classic.json
+# Без --start-postgres используется база из настроек (.env): таблица users
+# не очищается, добавленные бенчмарком строки удаляются на шаге delete.
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psycopg2
+from sqlalchemy.engine import URL
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+
+import allin_alchemy
+import allin_classic
+import db_pool
+from get_all_users import iter_users as classic_iter_users
+
+OPERATIONS = ("add", "find", "update", "list", "delete")
+IMPLEMENTATIONS = ("classic", "alchemy")
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по методу ближайшего ранга; sorted_values - отсортированный список"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed, peak_memory):
+    """Сводка по одной операции: операций/с, задержки в мс и пик памяти"""
+    ordered = sorted(latencies)
+    return {
+        "ops": len(ordered),
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(len(ordered) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        "peak_memory_kb": round(peak_memory / 1024, 1) if peak_memory is not None else None,
+    }
+
+
+def split(items, parts):
+    """Делит список на parts примерно равных частей (пустые отбрасываются)"""
+    return [chunk for chunk in (items[index::parts] for index in range(parts)) if chunk]
+
+
+class ClassicTarget:
+    """Операции allin_classic: у каждого потока свое соединение из db_pool"""
+
+    name = "classic"
+
+    def __init__(self, settings, concurrency):
+        db_pool.configure(minconn=1, maxconn=concurrency, **settings)
+        with db_pool.connection() as conn:
+            allin_classic.create_table(conn)
+
+    @contextmanager
+    def worker(self):
+        with db_pool.connection() as conn:
+            yield conn
+
+    def add(self, conn, number):
+        return allin_classic.insert_user(conn, f"bench_{number}")
+
+    def find(self, conn, user_id):
+        return allin_classic.get_user(conn, user_id)
+
+    def update(self, conn, user_id):
+        return allin_classic.rename_user(conn, user_id, f"bench_{user_id}_renamed")
+
+    def list(self, conn, _):
+        # Та же сортировка и тот же размер порции, что у allin_alchemy.iter_users
+        count = sum(1 for _ in classic_iter_users(conn, "users", allin_alchemy.LIST_BATCH_SIZE,
+                                                  order_by_id=True))
+        # Серверный курсор живет в транзакции - закрываем ее
+        conn.rollback()
+        return count
+
+    def delete(self, conn, user_id):
+        return allin_classic.remove_user(conn, user_id)
+
+    def close(self):
+        db_pool.close_pool()
+
+
+class AlchemyTarget:
+    """Операции allin_alchemy: у каждого потока своя сессия общего движка"""
+
+    name = "alchemy"
+
+    def __init__(self, settings, concurrency):
+        # URL.create экранирует спецсимволы в пароле (как db_engine.database_url)
+        url = URL.create("postgresql", username=settings["user"],
+                         password=settings.get("password") or None, host=settings["host"],
+                         port=int(settings["port"]), database=settings["dbname"])
+        session = allin_alchemy.init_db(url, pool_size=concurrency, max_overflow=0)
+        self.engine = session.bind
+        session.close()
+        self.Session = sessionmaker(bind=self.engine)
+
+    @contextmanager
+    def worker(self):
+        session = self.Session()
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def add(self, session, number):
+        return allin_alchemy.insert_user(session, f"bench_{number}")
+
+    def find(self, session, user_id):
+        return allin_alchemy.get_user(session, user_id)
+
+    def update(self, session, user_id):
+        return allin_alchemy.rename_user(session, user_id, f"bench_{user_id}_renamed")
+
+    def list(self, session, _):
+        count = sum(1 for _ in allin_alchemy.iter_users(session))
+        session.rollback()
+        return count
+
+    def delete(self, session, user_id):
+        return allin_alchemy.remove_user(session, user_id)
+
+    def close(self):
+        self.engine.dispose()
+
+
+TARGETS = {"classic": ClassicTarget, "alchemy": AlchemyTarget}
+
+
+def run_operation(target, operation, items, concurrency, measure_memory):
+    """
+    Выполняет операцию для каждого элемента items в concurrency потоках
+    Возвращает (результаты операций, сводку summarize)
+    """
+    method = getattr(target, operation)
+
+    def work(chunk):
+        latencies = []
+        results = []
+        with target.worker() as handle:
+            for item in chunk:
+                started = time.perf_counter()
+                results.append(method(handle, item))
+                latencies.append(time.perf_counter() - started)
+        return results, latencies
+
+    if measure_memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(work, split(items, concurrency)))
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if measure_memory else None
+
+    results = [result for chunk_results, _ in outcomes for result in chunk_results]
+    latencies = [latency for _, chunk_latencies in outcomes for latency in chunk_latencies]
+    return results, summarize(latencies, elapsed, peak)
+
+
+def run_target(name, settings, rows, concurrency, list_repeats, measure_memory):
+    """Прогоняет все операции одной реализации, возвращает {операция: сводка}"""
+    target = TARGETS[name](settings, concurrency)
+    report = {}
+    try:
+        ids, report["add"] = run_operation(
+            target, "add", list(range(rows)), concurrency, measure_memory)
+        _, report["find"] = run_operation(target, "find", ids, concurrency, measure_memory)
+        _, report["update"] = run_operation(target, "update", ids, concurrency, measure_memory)
+        _, report["list"] = run_operation(
+            target, "list", list(range(list_repeats)), concurrency, measure_memory)
+        _, report["delete"] = run_operation(target, "delete", ids, concurrency, measure_memory)
+    finally:
+        target.close()
+    return report
+
+
+def free_port():
+    """Свободный TCP-порт на localhost"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def find_pg_binary(name):
+    """Ищет initdb / pg_ctl в PATH или в каталоге из pg_config --bindir"""
+    path = shutil.which(name)
+    if path:
+        return path
+    pg_config = shutil.which("pg_config")
+    if pg_config:
+        bindir = subprocess.run([pg_config, "--bindir"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        candidate = os.path.join(bindir, name)
+        if os.path.exists(candidate):
+            return candidate
+    raise RuntimeError(f"Не найден {name}: установите PostgreSQL или добавьте его bin в PATH")
+
+
+@contextmanager
+def temporary_postgres():
+    """
+    Запускает временный сервер PostgreSQL во временном каталоге на свободном порту
+    и создает в нем базу bench. Отдает параметры подключения (как DB_SETTINGS),
+    после выхода сервер останавливается, а каталог удаляется
+    """
+    initdb = find_pg_binary("initdb")
+    pg_ctl = find_pg_binary("pg_ctl")
+    data_dir = tempfile.mkdtemp(prefix="bench_pg_")
+    port = free_port()
+    log_path = os.path.join(data_dir, "server.log")
+    try:
+        subprocess.run([initdb, "-D", os.path.join(data_dir, "data"), "-U", "postgres",
+                        "--auth=trust", "-E", "UTF8"],
+                       check=True, capture_output=True)
+        subprocess.run([pg_ctl, "-D", os.path.join(data_dir, "data"), "-l", log_path, "-w",
+                        "-o", f"-p {port} -c listen_addresses=127.0.0.1 -k {data_dir}",
+                        "start"],
+                       check=True, capture_output=True)
+        try:
+            admin = psycopg2.connect(dbname="postgres", user="postgres",
+                                     host="127.0.0.1", port=port)
+            admin.autocommit = True
+            with admin.cursor() as cursor:
+                cursor.execute("CREATE DATABASE bench;")
+            admin.close()
+            yield {"dbname": "bench", "user": "postgres", "password": "",
+                   "host": "127.0.0.1", "port": str(port)}
+        finally:
+            subprocess.run([pg_ctl, "-D", os.path.join(data_dir, "data"), "-m", "fast",
+                            "-w", "stop"], capture_output=True)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def server_version(settings):
+    """Версия сервера PostgreSQL, на котором шел прогон"""
+    conn = psycopg2.connect(**settings)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW server_version;")
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def git_revision():
+    """Текущий коммит репозитория или None"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results):
+    """Выводит таблицу результатов"""
+    print(f"\n{'реализация':<10} {'операция':<8} {'операций':>8} {'опер/с':>10} "
+          f"{'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'память, КБ':>11}")
+    for name, report in results.items():
+        for operation in OPERATIONS:
+            item = report[operation]
+            memory = item["peak_memory_kb"]
+            print(f"{name:<10} {operation:<8} {item['ops']:>8} {item['ops_per_sec']:>10.1f} "
+                  f"{item['p50_ms']:>9.3f} {item['p95_ms']:>9.3f} {item['p99_ms']:>9.3f} "
+                  f"{memory if memory is not None else '-':>11}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк allin_classic и allin_alchemy")
+    parser.add_argument("--rows", type=int, default=1000, help="сколько пользователей добавлять")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="число потоков (и соединений)")
+    parser.add_argument("--list-repeats", type=int, default=5,
+                        help="сколько раз читать всю таблицу на шаге list")
+    parser.add_argument("--impl", default=",".join(IMPLEMENTATIONS),
+                        help="реализации через запятую: classic,alchemy")
+    parser.add_argument("--start-postgres", action="store_true",
+                        help="запустить временный сервер PostgreSQL (нужны initdb и pg_ctl)")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="не измерять память (tracemalloc замедляет Python-код)")
+    parser.add_argument("--output", default="bench_results.json", help="файл для результатов JSON")
+    return parser.parse_args()
+
+
+def run(args, settings):
+    measure_memory = not args.no_memory
+    if measure_memory:
+        tracemalloc.start()
+
+    results = {}
+    for name in args.impl.split(","):
+        name = name.strip()
+        print(f"Реализация {name}: {args.rows} строк, потоков {args.concurrency}...")
+        results[name] = run_target(name, settings, args.rows, args.concurrency,
+                                   args.list_repeats, measure_memory)
+    print_report(results)
+
+    document = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "server_version": server_version(settings),
+        "rows": args.rows,
+        "concurrency": args.concurrency,
+        "list_repeats": args.list_repeats,
+        "prepared_statements": allin_classic.USE_PREPARED,
+        "user_cache_size": allin_alchemy.user_cache.max_entries,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(document, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены в {args.output}")
+
+
+def main():
+    args = parse_args()
+    unknown = set(name.strip() for name in args.impl.split(",")) - set(IMPLEMENTATIONS)
+    if unknown:
+        print(f"Неизвестные реализации: {', '.join(sorted(unknown))}")
+        sys.exit(2)
+
+    try:
+        if args.start_postgres:
+            with temporary_postgres() as settings:
+                run(args, settings)
+        else:
+            run(args, dict(db_pool.DB_SETTINGS))
+    except (psycopg2.Error, SQLAlchemyError, RuntimeError, subprocess.CalledProcessError) as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,38 @@
 from vkbottle.bot import Bot, Message
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 from models import Appeal, Manager, Topic, Status
-from config import SessionLocal, MANAGERS, BOT_TOKEN
+from config import SessionLocal, AsyncSessionLocal, MANAGERS, BOT_TOKEN
+from db_session import async_session_scope, session_scope
+from manager_routing import ManagerRoute, ManagerRouting
+from outbox import OutboundDispatcher
 from typing import Optional
 
 bot = Bot(token=BOT_TOKEN)
 
-# Функция для работы с базой данных
-def get_db() -> Session:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Сессия на один обработчик: COMMIT при выходе из блока, откат при ошибке,
+# соединение всегда возвращается в пул
+def db_scope():
+    return async_session_scope(AsyncSessionLocal)
+
+# Тема -> менеджер в памяти: без запроса к базе на каждое обращение
+routing = ManagerRouting(AsyncSessionLocal)
+
+# Только поиск в памяти: таблицу обновляет routing.refresh() до открытия сессии
+def get_manager_by_topic(topic: Topic) -> Optional[ManagerRoute]:
+    return routing.route(topic)
+
+# Один запрос к API ВК; вызывается только воркерами очереди outbox
+async def deliver_message(user_id: int, text: str, random_id: int):
+    await bot.api.messages.send(user_id=user_id, message=text, random_id=random_id)
 
-def get_manager_by_topic(topic: Topic, db: Session) -> Optional[Manager]:
-    return db.query(Manager).filter(Manager.topic == topic).first()
+# Исходящие сообщения: очередь с ограничением частоты, повторами и сохранением в базу
+outbox = OutboundDispatcher(deliver_message, AsyncSessionLocal)
+
+# Отправка сообщения пользователю ВК: записывает его в outbound_messages
+# в транзакции обработчика (db) и не ждет API - воркеры отправят его после COMMIT
+# (отдельная функция, чтобы ее можно было подменить в bot_load.py)
+async def send_message(db, user_id: int, text: str):
+    outbox.stage(db, user_id, text)
 
 @bot.on.message(text="Начать")
 async def start_handler(message: Message):
@@ -42,11 +59,10 @@ async def topic_handler(message: Message):
     topic = topics.get(message.text)
     if topic:
         await message.answer(f"Выбрана тема: {topic.value}\nНапиши текст обращения:")
-        db = next(get_db())
-        appeal = Appeal(student_id=message.from_id, topic=topic, text="", status=Status.NEW)
-        db.add(appeal)
-        db.commit()
-        db.refresh(appeal)
+        # Асинхронная сессия: пока база отвечает, бот обрабатывает другие сообщения
+        async with db_scope() as db:
+            appeal = Appeal(student_id=message.from_id, topic=topic, text="", status=Status.NEW)
+            db.add(appeal)
         await message.answer(f"Создано обращение №{appeal.id}. Напиши текст обращения.")
     else:
         await message.answer("Пожалуйста, выбери тему из списка (1-5)")
@@ -63,30 +79,32 @@ async def response_handler(message: Message):
         appeal_id = int(parts[1])
         response_text = parts[2]
 
-        db = next(get_db())
-        appeal = db.query(Appeal).filter(Appeal.id == appeal_id).first()
-
-        if not appeal:
-            await message.answer("Обращение с таким номером не найдено")
-            return
+        error = None
+        async with db_scope() as db:
+            appeal = await db.get(Appeal, appeal_id)
+
+            if not appeal:
+                error = "Обращение с таким номером не найдено"
+            elif appeal.status != Status.NEW:
+                error = "На это обращение уже был дан ответ"
+            else:
+                appeal.status = Status.RESOLVED
+                appeal.response = response_text
+                # Сообщение студенту фиксируется тем же COMMIT, что и ответ
+                await send_message(
+                    db,
+                    appeal.student_id,
+                    f"Ответ на обращение #{appeal.id}\n"
+                    f"Тема: {appeal.topic.value}\n"
+                    f"Ответ: {response_text}"
+                )
 
-        if appeal.status != Status.NEW:
-            await message.answer("На это обращение уже был дан ответ")
+        # Соединение уже возвращено в пул - ответы в ВК его не держат
+        if error:
+            await message.answer(error)
             return
 
-        appeal.status = Status.RESOLVED
-        appeal.response = response_text
-        db.commit()
-
-        await bot.api.messages.send(
-            user_id=appeal.student_id,
-            message=f"Ответ на обращение #{appeal.id}\n"
-                    f"Тема: {appeal.topic.value}\n"
-                    f"Ответ: {response_text}",
-            #random_id=0
-        )
-
-        await message.answer("Ответ успешно отправлен студенту")
+        await message.answer("Ответ принят и будет отправлен студенту")
 
     except Exception:
         await message.answer("Неправильный формат команды. Пример: Ответ 42 Ваше обращение рассмотрено")
@@ -99,52 +117,76 @@ async def status_handler(message: Message, appeal_id: int, status: str):
         await message.answer("Неверный статус. Возможные: NEW, IN_PROGRESS, RESOLVED")
         return
 
-    db = next(get_db())
-    appeal = db.query(Appeal).filter(Appeal.id == appeal_id).first()
+    async with db_scope() as db:
+        appeal = await db.get(Appeal, appeal_id)
+        if appeal:
+            appeal.status = status_enum
 
+    # Ответ отправляется, когда соединение уже вернулось в пул
     if not appeal:
         await message.answer("Обращение с таким номером не найдено")
         return
+    await message.answer(f"Статус обращения #{appeal_id} изменен на {status_enum.value}")
+
+
+# Перечитать менеджеров из базы (после их изменения); доступно только менеджерам
+@bot.on.message(text="Обновить менеджеров")
+async def reload_managers_handler(message: Message):
+    if message.from_id not in MANAGERS and not await routing.is_manager(message.from_id):
+        await message.answer("Команда доступна только менеджерам")
+        return
 
-    appeal.status = status_enum
-    db.commit()
+    try:
+        topics = await routing.load()
+    except Exception as e:
+        await message.answer(f"Не удалось обновить список менеджеров, используется прежний: {e}")
+        return
+    await message.answer(f"Список менеджеров обновлен, тем с менеджером: {topics}")
 
-    await message.answer(f"Статус обращения #{appeal_id} изменен на {status_enum.value}")
+
+# Метрики очереди исходящих сообщений; доступно только менеджерам
+@bot.on.message(text="Статистика отправки")
+async def outbox_stats_handler(message: Message):
+    if message.from_id not in MANAGERS and not await routing.is_manager(message.from_id):
+        await message.answer("Команда доступна только менеджерам")
+        return
+
+    await message.answer(outbox.format_metrics())
 
 
 @bot.on.message()
 async def appeal_handler(message: Message):
-    db = next(get_db())
-
-    # Ищем самое новое обращение этого пользователя
-    appeal = db.query(Appeal).filter(Appeal.student_id == message.from_id, Appeal.status == Status.NEW).first()
+    # Таблица менеджеров обновляется до того, как обработчик займет соединение
+    await routing.refresh()
+
+    async with db_scope() as db:
+        # Ищем самое новое обращение этого пользователя
+        appeal = await db.scalar(
+            select(Appeal)
+            .where(Appeal.student_id == message.from_id, Appeal.status == Status.NEW)
+            .limit(1)
+        )
 
-    if appeal:
-        # Обновляем текст обращения
-        appeal.text = message.text
-        db.commit()
-
-        # Проверяем наличие менеджера для этой темы
-        manager = get_manager_by_topic(appeal.topic, db)
-        if manager:
-            appeal.manager_id = manager.id
-            db.commit()
-
-            try:
-                # Проверяем разрешение на отправку сообщения менеджеру
-                await bot.api.messages.send(
-                    user_id=manager.vk_id,
-                    message=f"Новое обращение #{appeal.id}\n"
-                            f"Тема: {appeal.topic.value}\n"
-                            f"Текст: {message.text}\n\n"
-                            f"Чтобы ответить, отправь:\n"
-                            f"Ответ [номер] [текст ответа]",
-                    random_id=0
+        manager = None
+        if appeal:
+            # Обновляем текст обращения и назначаем менеджера одним commit
+            appeal.text = message.text
+            manager = get_manager_by_topic(appeal.topic)
+            if manager:
+                appeal.manager_id = manager.id
+                # Уведомление менеджеру записывается в outbox тем же COMMIT:
+                # ответ студенту его не ждет, а после падения бота оно не потеряется
+                await send_message(
+                    db,
+                    manager.vk_id,
+                    f"Новое обращение #{appeal.id}\n"
+                    f"Тема: {appeal.topic.value}\n"
+                    f"Текст: {message.text}\n\n"
+                    f"Чтобы ответить, отправь:\n"
+                    f"Ответ [номер] [текст ответа]"
                 )
-            except Exception as e:
-                # Обработка ошибок при отправке сообщения
-                print(f"Ошибка при отправке сообщения менеджеру: {e}")
 
+    if appeal:
         await message.answer(f"Обращение #{appeal.id} принято!\nТема: {appeal.topic.value}")
     else:
         await message.answer("Вы ещё не начали писать обращение.\nВведите номер темы для начала.")
@@ -155,11 +197,17 @@ if __name__ == "__main__":
 
     Base.metadata.create_all(bind=engine)
 
-    db = next(get_db())
-    for vk_id, topic in MANAGERS.items():
-        if not db.query(Manager).filter(Manager.vk_id == vk_id).first():
-            manager = Manager(vk_id=vk_id, name=f"Manager {vk_id}", topic=topic)
-            db.add(manager)
-    db.commit()
+    with session_scope(SessionLocal) as db:
+        for vk_id, topic in MANAGERS.items():
+            if not db.query(Manager).filter(Manager.vk_id == vk_id).first():
+                manager = Manager(vk_id=vk_id, name=f"Manager {vk_id}", topic=topic)
+                db.add(manager)
+    # Менеджеры могли измениться - таблица маршрутизации загружается при старте
+    routing.invalidate()
+    bot.loop_wrapper.on_startup.append(routing.refresh())
+    # Воркеры очереди запускаются вместе с ботом; при остановке
+    # неотправленные сообщения сохраняются в таблицу outbound_messages
+    bot.loop_wrapper.on_startup.append(outbox.start())
+    bot.loop_wrapper.on_shutdown.append(outbox.stop())
 
     bot.run_forever()
@@ -0,0 +1,205 @@
+# Нагрузочная проверка обработчиков bot.py без обращения к ВК
+#
+# Сообщения студентов ("1" - выбор темы, затем текст обращения) подаются прямо
+# в topic_handler и appeal_handler поддельными объектами Message, а отправка
+# сообщений в ВК (bot.send_message) заменяется заглушкой, которая ничего
+# не записывает в outbound_messages. Для каждого уровня
+# параллельности выводятся:
+# - пик одновременно выполняющихся обработчиков: если обращения к базе
+#   блокируют цикл событий, обработчики выполняются строго по одному (пик 1),
+#   с асинхронной сессией пик растет вместе с числом сообщений в обработке;
+# - максимальная задержка цикла событий (насколько опаздывает таймер);
+# - сообщений в секунду и статистика пула соединений.
+#
+# Режим --soak N прогоняет N сообщений порциями и после каждой порции выводит
+# число занятых соединений пула и счетчики сессий (db_session.tracker):
+# между порциями все соединения должны вернуться в пул, а незакрытых
+# и утекших сессий быть не должно. Иначе программа завершается с кодом 1.
+#
+# Нужен .env с настройками бота и базы. Обращения создаются в таблице appeals
+# с отрицательными student_id и удаляются после прогона.
+#
+#     python bot_load.py --students 500 --concurrency 1,10,50
+#     python bot_load.py --soak 100000 --concurrency 50
+import argparse
+import asyncio
+import gc
+import sys
+import time
+
+from sqlalchemy import delete
+
+import bot as bot_app
+from config import AsyncSessionLocal, async_engine, engine
+from db_engine import pool_stats, print_pool_stats
+from db_session import async_session_scope, tracker
+from models import Appeal, Base
+
+
+class FakeMessage:
+    """
+    Минимальная замена vkbottle Message: текст, отправитель и ответы бота
+    answer() не уступает управление циклу событий, поэтому все переключения
+    между обработчиками происходят только на обращениях к базе
+    """
+
+    def __init__(self, text, from_id):
+        self.text = text
+        self.from_id = from_id
+        self.answers = []
+
+    async def answer(self, text, **params):
+        self.answers.append(text)
+
+
+class LoadStats:
+    """Счетчики одного прогона"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.handled = 0
+        self.sent = 0
+        self.loop_lag_max = 0.0
+
+
+async def tracked(handler, message, stats):
+    """Вызывает обработчик, считая одновременно выполняющиеся"""
+    stats.in_flight += 1
+    stats.peak_in_flight = max(stats.peak_in_flight, stats.in_flight)
+    try:
+        await handler(message)
+    finally:
+        stats.in_flight -= 1
+        stats.handled += 1
+
+
+async def student(from_id, stats):
+    """Один студент: выбирает тему и пишет текст обращения"""
+    await tracked(bot_app.topic_handler, FakeMessage("1", from_id), stats)
+    await tracked(bot_app.appeal_handler, FakeMessage(f"Нагрузочное обращение {from_id}", from_id),
+                  stats)
+
+
+async def watch_loop_lag(stats, stop, interval=0.01):
+    """Замеряет, насколько позже положенного просыпается таймер цикла событий"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        stats.loop_lag_max = max(stats.loop_lag_max, loop.time() - started - interval)
+
+
+async def run_level(students, concurrency, first_id):
+    """
+    Прогоняет students студентов, не больше concurrency одновременно
+    first_id - отрицательный student_id первого студента
+    Возвращает (LoadStats, секунды)
+    """
+    stats = LoadStats()
+
+    async def fake_send(db, user_id, text, **params):
+        stats.sent += 1
+
+    bot_app.send_message = fake_send
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(from_id):
+        async with semaphore:
+            await student(from_id, stats)
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop_lag(stats, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(first_id - number) for number in range(students)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await watcher
+    return stats, elapsed
+
+
+async def cleanup():
+    """Удаляет обращения, созданные проверкой"""
+    async with async_session_scope(AsyncSessionLocal) as db:
+        await db.execute(delete(Appeal).where(Appeal.student_id < 0))
+
+
+async def run(students, levels):
+    """Прогоняет уровни параллельности и выводит таблицу"""
+    print(f"{'параллельно':>11} {'сообщений':>10} {'сообщ/с':>9} "
+          f"{'пик обработчиков':>17} {'задержка цикла, мс':>19}")
+    try:
+        for index, concurrency in enumerate(levels):
+            stats, elapsed = await run_level(students, concurrency, -1 - index * students)
+            rate = stats.handled / elapsed if elapsed > 0 else 0
+            print(f"{concurrency:>11} {stats.handled:>10} {rate:>9.0f} "
+                  f"{stats.peak_in_flight:>17} {stats.loop_lag_max * 1000:>19.1f}")
+        print_pool_stats(async_engine)
+    finally:
+        await cleanup()
+        await async_engine.dispose()
+
+
+async def soak(messages, concurrency, sample_every):
+    """
+    Длительный прогон: messages сообщений порциями по sample_every
+    Возвращает True, если после каждой порции все соединения и сессии освобождены
+    """
+    students = max(1, messages // 2)
+    per_round = max(1, sample_every // 2)
+    steady = True
+    print(f"{'сообщений':>10} {'сообщ/с':>9} {'занято соединений':>18} "
+          f"{'открыто всего':>14} {'незакрытых сессий':>18} {'утекших':>8}")
+    try:
+        done = 0
+        while done < students:
+            count = min(per_round, students - done)
+            stats, elapsed = await run_level(count, concurrency, -1 - done)
+            done += count
+            # Незакрытые сессии попадают в leaked только после сборки мусора
+            gc.collect()
+            await cleanup()
+
+            pool = pool_stats(async_engine)
+            sessions = tracker.stats()
+            rate = stats.handled / elapsed if elapsed > 0 else 0
+            print(f"{done * 2:>10} {rate:>9.0f} {pool['checked_out']:>18} "
+                  f"{pool['connects']:>14} {sessions['outstanding']:>18} {sessions['leaked']:>8}")
+            if pool["checked_out"] or sessions["outstanding"] or sessions["leaked"]:
+                steady = False
+        print_pool_stats(async_engine)
+    finally:
+        await async_engine.dispose()
+
+    print("✓ Соединения и сессии освобождаются стабильно" if steady
+          else "× Обнаружена утечка соединений или сессий")
+    return steady
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка обработчиков bot.py")
+    parser.add_argument("--students", type=int, default=200,
+                        help="сколько студентов на каждом уровне (по 2 сообщения)")
+    parser.add_argument("--concurrency", default="1,10,50",
+                        help="уровни параллельности через запятую "
+                             "(для --soak используется последний)")
+    parser.add_argument("--soak", type=int, metavar="MESSAGES",
+                        help="длительный прогон на указанное число сообщений (например 100000)")
+    parser.add_argument("--sample-every", type=int, default=10000,
+                        help="через сколько сообщений проверять пул в режиме --soak")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    Base.metadata.create_all(bind=engine)
+    if args.soak:
+        steady = asyncio.run(soak(args.soak, levels[-1], args.sample_every))
+        sys.exit(0 if steady else 1)
+    asyncio.run(run(args.students, levels))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# Пакетное выполнение команд для allin_classic.py и allin_alchemy.py
+#
+# Команды читаются из файла или stdin, по одной на строку (аргументы - как
+# в командной строке, имена с пробелами берутся в кавычки, # - комментарий):
+#   add ИМЯ           - добавить пользователя
+#   delete ID         - удалить пользователя
+#   update ID ИМЯ     - переименовать пользователя
+#   find ID           - найти пользователя
+#   list [N]          - вывести пользователей (не больше N)
+#
+# Подряд идущие изменения (add/delete/update) выполняются одной транзакцией
+# из не более чем group_size команд: один COMMIT на группу вместо одного на
+# команду. Чтение (find/list) сначала фиксирует накопленную группу.
+# Если команда группы завершилась ошибкой, откатывается вся группа.
+#
+# Результат - строки JSON (одна на команду) в stdout:
+#   {"line": 3, "command": "add", "ok": true, "result": {"id": 17}}
+#   {"line": 4, "command": "delete", "ok": false, "error": "..."}
+# list выводит по строке на пользователя (в порядке ID) и итоговую строку:
+#   {"line": 5, "command": "list", "ok": true, "result": {"user": [1, "Alice"]}}
+#   {"line": 5, "command": "list", "ok": true, "result": {"count": 1}}
+# Результаты изменений выводятся после COMMIT (или отката) их группы; ошибки
+# разбора строк внутри группы выводятся вместе с ней, поэтому строки
+# результата всегда идут в порядке строк команд.
+# Последней строкой выводится {"summary": {...}}.
+import json
+import shlex
+import sys
+from itertools import islice
+
+# Команды и число их аргументов (для list аргумент необязателен)
+WRITE_COMMANDS = {"add": 1, "delete": 1, "update": 2}
+READ_COMMANDS = {"find": 1, "list": None}
+
+DEFAULT_GROUP_SIZE = 100
+
+
+def parse_command(line):
+    """
+    Разбирает строку команды
+    Возвращает (команда, аргументы) или None для пустой строки и комментария
+    Выбрасывает ValueError, если команда неизвестна или аргументы неверны
+    """
+    parts = shlex.split(line, comments=True)
+    if not parts:
+        return None
+    command, args = parts[0].lower(), parts[1:]
+
+    if command in WRITE_COMMANDS:
+        expected = WRITE_COMMANDS[command]
+        if len(args) != expected:
+            raise ValueError(f"{command}: ожидается аргументов: {expected}")
+    elif command == "find":
+        if len(args) != 1:
+            raise ValueError("find: ожидается ID")
+    elif command == "list":
+        if len(args) > 1:
+            raise ValueError("list: ожидается не больше одного аргумента")
+    else:
+        raise ValueError(f"Неизвестная команда: {command}")
+
+    if command in ("delete", "update", "find") or (command == "list" and args):
+        if not args[0].isdigit():
+            raise ValueError(f"{command}: {args[0]} - не число")
+        args[0] = int(args[0])
+    return command, args
+
+
+def run_commands(lines, backend, group_size=DEFAULT_GROUP_SIZE, out=None):
+    """
+    Выполняет команды и пишет результаты в out строками JSON
+    lines - итерируемый объект со строками команд (например, открытый файл)
+    backend - объект с методами add(name), delete(user_id), update(user_id, name),
+              find(user_id), list(), commit(), rollback() и атрибутом errors -
+              кортежем исключений базы данных. Методы изменений не фиксируют
+              транзакцию; list() возвращает кортежи (id, name) по порядку ID,
+              остальные методы - словари для поля result
+    group_size - сколько изменений фиксировать одним COMMIT
+    Возвращает словарь со сводкой
+    """
+    out = out or sys.stdout
+    summary = {"commands": 0, "failed": 0, "commits": 0, "rollbacks": 0}
+    pending = []  # результаты изменений незафиксированной группы
+
+    def emit(record):
+        if not record["ok"]:
+            summary["failed"] += 1
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def fail_group(error):
+        # Откат отменяет и уже выполненные команды группы
+        backend.rollback()
+        summary["rollbacks"] += 1
+        for record in pending:
+            if record["ok"]:
+                record = {"line": record["line"], "command": record["command"],
+                          "ok": False, "error": f"отменено откатом группы: {error}"}
+            emit(record)
+        pending.clear()
+
+    def commit_group():
+        if not pending:
+            return
+        try:
+            backend.commit()
+        except backend.errors as e:
+            fail_group(e)
+            return
+        summary["commits"] += 1
+        for record in pending:
+            emit(record)
+        pending.clear()
+
+    for number, line in enumerate(lines, start=1):
+        try:
+            parsed = parse_command(line)
+        except ValueError as e:
+            summary["commands"] += 1
+            record = {"line": number, "command": None, "ok": False, "error": str(e)}
+            # Внутри группы ошибка ждет ее COMMIT, чтобы не обогнать предыдущие строки
+            if pending:
+                pending.append(record)
+            else:
+                emit(record)
+            continue
+        if parsed is None:
+            continue
+
+        summary["commands"] += 1
+        command, args = parsed
+        record = {"line": number, "command": command}
+
+        if command in READ_COMMANDS:
+            commit_group()
+            try:
+                if command == "find":
+                    result = backend.find(args[0])
+                else:
+                    # По строке на пользователя: вывод не собирается в памяти целиком
+                    users = backend.list()
+                    if args:
+                        users = islice(users, args[0])
+                    count = 0
+                    for user in users:
+                        out.write(json.dumps(dict(record, ok=True, result={"user": list(user)}),
+                                             ensure_ascii=False) + "\n")
+                        count += 1
+                    result = {"count": count}
+                emit(dict(record, ok=True, result=result))
+            except backend.errors as e:
+                backend.rollback()
+                emit(dict(record, ok=False, error=str(e)))
+            continue
+
+        try:
+            result = getattr(backend, command)(*args)
+        except backend.errors as e:
+            pending.append(dict(record, ok=False, error=str(e)))
+            fail_group(e)
+            continue
+        pending.append(dict(record, ok=True, result=result))
+        if len(pending) >= group_size:
+            commit_group()
+
+    commit_group()
+    out.write(json.dumps({"summary": summary}, ensure_ascii=False) + "\n")
+    return summary
+
+
+def open_script(path):
+    """Открывает файл команд; "-" - стандартный ввод"""
+    if path == "-":
+        return sys.stdin
+    return open(path, encoding="utf-8")
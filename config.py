@@ -1,9 +1,11 @@
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from vkbottle import Bot
 from models import Topic  # Добавьте этот импорт в начало файла
+from db_engine import database_url, make_engine, make_async_engine  # Движки с настройками пула из .env и метриками
+from db_session import TrackedSession  # Сессии, которые учитывает db_session.tracker
 load_dotenv()
 
 # VK Bot Token
@@ -17,9 +19,18 @@ DB_PORT = os.getenv("DB_PORT")  # Порт подключения
 
 # Database
 
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# database_url() экранирует спецсимволы в пароле (@, :, / и т.п.)
+DATABASE_URL = database_url()
+engine = make_engine(DATABASE_URL)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=TrackedSession)
+
+# Асинхронный движок (asyncpg) для обработчиков бота: пока запрос ждет
+# ответа базы, цикл событий обрабатывает сообщения других пользователей.
+# expire_on_commit=False - после commit атрибуты объектов читаются без нового запроса
+ASYNC_DATABASE_URL = database_url("postgresql+asyncpg")
+async_engine = make_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False,
+                                       sync_session_class=TrackedSession)
 
 # Managers config (vk_id: topic)
 MANAGERS = {
@@ -0,0 +1,239 @@
+# Создание движков SQLAlchemy с настройками пула из окружения и метриками пула
+#
+# Переменные окружения (или файл .env):
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT - параметры подключения,
+#   те же, что у db_pool.py и config.py (строку подключения дает database_url())
+#   DB_POOL_SIZE - сколько соединений пул держит открытыми (по умолчанию 5)
+#   DB_MAX_OVERFLOW - сколько соединений можно открыть сверх DB_POOL_SIZE (10)
+#   DB_POOL_TIMEOUT - сколько секунд ждать свободное соединение (30)
+#   DB_POOL_RECYCLE - через сколько секунд соединение пересоздается (1800, -1 - никогда)
+#   DB_POOL_PRE_PING - проверять ли соединение перед выдачей (1/0, по умолчанию 1)
+#   DB_STATEMENT_TIMEOUT_MS - statement_timeout на сервере, мс (0 - без ограничения)
+# Статистика SQL-запросов включается через SQL_STATS=1 (см. sql_instrumentation.py)
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+from sql_instrumentation import instrument_from_env
+
+load_dotenv()
+
+DB_NAME = os.getenv("DB_NAME", "")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+
+def database_url(driver="postgresql"):
+    """
+    Строка подключения из DB_* (.env)
+    driver - "postgresql" (psycopg2) или "postgresql+asyncpg"
+    """
+    # URL.create сам экранирует спецсимволы в пароле
+    return URL.create(driver, username=DB_USER, password=DB_PASSWORD or None,
+                      host=DB_HOST, port=int(DB_PORT), database=DB_NAME)
+
+
+def engine_options(async_driver=False, **overrides):
+    """
+    Параметры для create_engine / create_async_engine
+    async_driver - True для asyncpg (statement_timeout передается иначе, чем в psycopg2)
+    overrides - параметры, которые нужно заменить (например pool_size=2)
+    """
+    options = {
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+    if STATEMENT_TIMEOUT_MS > 0:
+        if async_driver:
+            options["connect_args"] = {
+                "server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {
+                "options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+    options.update(overrides)
+    return options
+
+
+class PoolMetrics:
+    """
+    Счетчики пула соединений:
+    - checkouts / checkins - сколько раз соединение выдавалось и возвращалось;
+    - hold_time - сколько соединение было занято от выдачи до возврата;
+    - waits / wait_time - сколько раз и как долго запрос ждал соединение,
+      потому что все соединения пула (включая overflow) были заняты;
+    - overflow_peak - максимальное число соединений сверх pool_size;
+    - connects - сколько физических соединений было открыто.
+    Позволяет отличить нехватку соединений (растут waits и wait_time)
+    от медленных запросов (растет hold_time при нулевых ожиданиях).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.hold_time = 0.0
+        self.hold_time_max = 0.0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.wait_time_max = 0.0
+        self.overflow_peak = 0
+
+    def attach(self, pool):
+        """Подписывается на события пула"""
+        pool.metrics = self
+        event.listen(pool, "connect", self._on_connect)
+        event.listen(pool, "checkout", self._on_checkout)
+        event.listen(pool, "checkin", self._on_checkin)
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += seconds
+            self.wait_time_max = max(self.wait_time_max, seconds)
+
+    def record_overflow(self, overflow):
+        with self._lock:
+            self.overflow_peak = max(self.overflow_peak, overflow)
+
+    def snapshot(self):
+        """Копия счетчиков в виде словаря"""
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "hold_time_avg": self.hold_time / self.checkins if self.checkins else 0.0,
+                "hold_time_max": self.hold_time_max,
+                "waits": self.waits,
+                "wait_time_total": self.wait_time,
+                "wait_time_avg": self.wait_time / self.waits if self.waits else 0.0,
+                "wait_time_max": self.wait_time_max,
+                "overflow_peak": self.overflow_peak,
+            }
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checkout_at"] = time.perf_counter()
+        with self._lock:
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        started = connection_record.info.pop("checkout_at", None)
+        if started is None:
+            return
+        held = time.perf_counter() - started
+        with self._lock:
+            self.checkins += 1
+            self.hold_time += held
+            self.hold_time_max = max(self.hold_time_max, held)
+
+
+class _TimedGetMixin:
+    """
+    Измеряет время получения соединения из пула.
+    В событиях пула нет момента "начали ждать", поэтому переопределяется
+    QueuePool._do_get - место, где запрос блокируется до освобождения соединения.
+    """
+
+    metrics = None
+
+    def _do_get(self):
+        # _max_overflow == -1 означает "без ограничения"
+        limit = self._max_overflow
+        exhausted = self.checkedin() == 0 and limit != -1 and self.overflow() >= limit
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.metrics is not None:
+                if exhausted:
+                    self.metrics.record_wait(time.perf_counter() - started)
+                self.metrics.record_overflow(max(self.overflow(), 0))
+
+    def recreate(self):
+        # engine.dispose() пересоздает пул - счетчики переносим в новый
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+class TimedQueuePool(_TimedGetMixin, QueuePool):
+    """QueuePool с измерением ожидания соединения"""
+
+
+class TimedAsyncQueuePool(_TimedGetMixin, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool с измерением ожидания соединения"""
+
+
+def make_engine(database_url, **overrides):
+    """Синхронный движок с настройками пула из окружения и метриками"""
+    engine = create_engine(database_url, poolclass=TimedQueuePool,
+                           **engine_options(**overrides))
+    PoolMetrics().attach(engine.pool)
+    instrument_from_env(engine)
+    return engine
+
+
+def make_async_engine(database_url, **overrides):
+    """Асинхронный движок (asyncpg) с настройками пула из окружения и метриками"""
+    engine = create_async_engine(database_url, poolclass=TimedAsyncQueuePool,
+                                 **engine_options(async_driver=True, **overrides))
+    PoolMetrics().attach(engine.sync_engine.pool)
+    instrument_from_env(engine)
+    return engine
+
+
+def pool_stats(engine):
+    """
+    Снимок состояния пула движка: текущие значения и накопленные счетчики
+    engine - синхронный или асинхронный движок, созданный make_engine / make_async_engine
+    """
+    pool = getattr(engine, "sync_engine", engine).pool
+    stats = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        stats.update(metrics.snapshot())
+    return stats
+
+
+def print_pool_stats(engine):
+    """Выводит снимок pool_stats() в читаемом виде"""
+    stats = pool_stats(engine)
+    print("\nСтатистика пула соединений:")
+    print(f"Размер: {stats['size']}, занято: {stats['checked_out']}, "
+          f"свободно: {stats['idle']}, overflow: {stats['overflow']}")
+    if "checkouts" in stats:
+        print(f"Выдач: {stats['checkouts']}, открыто соединений: {stats['connects']}, "
+              f"пик overflow: {stats['overflow_peak']}")
+        print(f"Удержание соединения: в среднем {stats['hold_time_avg'] * 1000:.1f} мс, "
+              f"максимум {stats['hold_time_max'] * 1000:.1f} мс")
+        print(f"Ожиданий свободного соединения: {stats['waits']}, "
+              f"в среднем {stats['wait_time_avg'] * 1000:.1f} мс, "
+              f"максимум {stats['wait_time_max'] * 1000:.1f} мс")
@@ -0,0 +1,273 @@
+# Общий пул соединений для скриптов на psycopg2
+# (main.py, get_all_users.py, redact.py, allin_classic.py)
+#
+# Настройки подключения читаются из одного места - переменных окружения
+# или файла .env (как в config.py):
+#   DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT - параметры подключения
+#   DB_POOL_MIN - сколько соединений открыть сразу, DB_POOL_MAX - максимум соединений
+#   (все возвращенные соединения, до DB_POOL_MAX, остаются открытыми)
+#   DB_POOL_TIMEOUT - сколько секунд ждать свободное соединение
+#   DB_POOL_MAX_LIFETIME - через сколько секунд соединение пересоздается
+#   DB_POOL_HEALTH_CHECK - проверять ли соединение запросом при выдаче (1/0)
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_SETTINGS = {
+    "dbname": os.getenv("DB_NAME", ""),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432"),
+}
+
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+POOL_HEALTH_CHECK = os.getenv("DB_POOL_HEALTH_CHECK", "1") == "1"
+
+
+class PoolTimeout(pg_pool.PoolError):
+    """Свободное соединение не появилось за отведенное время"""
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2.
+    В отличие от psycopg2.pool.ThreadedConnectionPool:
+    - хранит свободными все возвращенные соединения (до maxconn), а не только
+      minconn: под нагрузкой соединения не закрываются и не открываются заново,
+      и подготовленные на них запросы (prepared.py) остаются в силе;
+    - при исчерпании пула ждет освободившееся соединение (до timeout секунд),
+      а не падает сразу с PoolError;
+    - при выдаче проверяет соединение запросом SELECT 1 и заменяет мертвые;
+    - пересоздает соединения старше max_lifetime секунд;
+    - считает статистику: занятые и свободные соединения, ожидания и их время.
+    minconn соединений открываются сразу при создании пула.
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 max_lifetime=POOL_MAX_LIFETIME, health_check=POOL_HEALTH_CHECK,
+                 **connect_kwargs):
+        self._connect_kwargs = connect_kwargs
+        # Семафор ограничивает число выданных соединений и дает возможность ждать
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._idle = []  # свободные соединения; последнее возвращенное выдается первым
+        # соединение -> время создания; запись удаляется при закрытии соединения
+        self._created = weakref.WeakKeyDictionary()
+        self._closed = False
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+
+        # Счетчики для stats()
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._recycled = 0
+        self._failed_checks = 0
+
+        for _ in range(min(minconn, maxconn)):
+            self._idle.append(self._connect())
+
+    def getconn(self):
+        """Выдает соединение из пула, при необходимости дожидаясь свободного"""
+        started = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            # Все соединения заняты - ждем
+            with self._lock:
+                self._waits += 1
+            acquired = self._slots.acquire(timeout=self.timeout)
+            with self._lock:
+                self._wait_time += time.perf_counter() - started
+            if not acquired:
+                raise PoolTimeout(f"Нет свободного соединения за {self.timeout} с")
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return conn
+
+    def putconn(self, conn, close=False):
+        """
+        Возвращает соединение в пул
+        Незавершенная транзакция откатывается, соединение в неизвестном
+        состоянии (например, оборванное) закрывается
+        """
+        with self._lock:
+            self._in_use -= 1
+        try:
+            if close or conn.closed or self._closed:
+                self._close(conn)
+                return
+            status = conn.info.transaction_status
+            if status == TRANSACTION_STATUS_UNKNOWN:
+                self._close(conn)
+                return
+            if status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with self._lock:
+                self._idle.append(conn)
+        except psycopg2.Error:
+            self._close(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер: with pool.connection() as conn: ..."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        """Снимок статистики пула"""
+        with self._lock:
+            return {
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "max": self.maxconn,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time": self._wait_time,
+                "recycled": self._recycled,
+                "failed_health_checks": self._failed_checks,
+            }
+
+    def closeall(self):
+        """
+        Закрывает свободные соединения пула; выданные соединения
+        закрываются, когда их вернут
+        """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._connect_kwargs)
+        with self._lock:
+            self._created[conn] = time.monotonic()
+        return conn
+
+    def _checkout(self):
+        # Каждая итерация либо выдает рабочее соединение, либо выбрасывает
+        # плохое; когда свободных не осталось, открывается новое
+        while True:
+            with self._lock:
+                if self._closed:
+                    raise pg_pool.PoolError("Пул соединений закрыт")
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+
+            created = self._created.get(conn, 0.0)
+            if conn.closed or time.monotonic() - created > self.max_lifetime:
+                self._close(conn)
+                with self._lock:
+                    self._recycled += 1
+                continue
+
+            if self.health_check and not self._is_alive(conn):
+                self._close(conn)
+                with self._lock:
+                    self._failed_checks += 1
+                continue
+
+            return conn
+
+    def _close(self, conn):
+        with self._lock:
+            self._created.pop(conn, None)
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    @staticmethod
+    def _is_alive(conn):
+        # В режиме autocommit SELECT 1 не открывает транзакцию,
+        # поэтому проверка стоит ровно одного обращения к серверу
+        autocommit = conn.autocommit
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1;")
+            conn.autocommit = autocommit
+            return True
+        except psycopg2.Error:
+            return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Параметры, заданные через configure(), поверх DB_SETTINGS
+_overrides = {}
+
+
+def configure(**settings):
+    """
+    Меняет параметры общего пула, например для подключения к тестовому серверу
+    settings - ключи DB_SETTINGS (dbname, user, host, ...) и параметры
+               ConnectionPool (minconn, maxconn, timeout, ...)
+    Уже открытый пул закрывается, новый создается при следующем обращении
+    """
+    close_pool()
+    with _pool_lock:
+        _overrides.update(settings)
+
+
+def get_pool():
+    """Возвращает общий пул процесса, создавая его при первом обращении"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(**{**DB_SETTINGS, **_overrides})
+        return _pool
+
+
+def connection():
+    """Соединение из общего пула: with db_pool.connection() as conn: ..."""
+    return get_pool().connection()
+
+
+def close_pool():
+    """Закрывает общий пул (например, перед выходом из программы)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def print_pool_stats():
+    """Выводит статистику общего пула"""
+    stats = get_pool().stats()
+    print("\nСтатистика пула соединений:")
+    print(f"Занято: {stats['in_use']}, свободно: {stats['idle']}, максимум: {stats['max']}")
+    print(f"Выдач: {stats['checkouts']}, ожиданий: {stats['waits']}, "
+          f"время ожидания: {stats['wait_time']:.3f} с")
+    print(f"Пересоздано по возрасту: {stats['recycled']}, "
+          f"не прошли проверку: {stats['failed_health_checks']}")
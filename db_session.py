@@ -0,0 +1,143 @@
+# Жизненный цикл сессий SQLAlchemy: одна сессия на одну единицу работы
+#
+# session_scope() (синхронная) и async_session_scope() (AsyncSession) открывают
+# сессию, фиксируют транзакцию при нормальном выходе из блока with, откатывают
+# ее при исключении и всегда закрывают сессию, возвращая соединение в пул:
+#
+#     async with async_session_scope(AsyncSessionLocal) as db:
+#         appeal = await db.get(Appeal, appeal_id)
+#         appeal.status = Status.RESOLVED
+#     # здесь уже выполнен COMMIT и соединение вернулось в пул
+#
+# SessionTracker считает открытые и закрытые сессии и "утекшие" - те, которые
+# собрал сборщик мусора, хотя close() для них не вызывался (как было
+# с next(get_db()) в bot.py). Рост outstanding или leaked - признак утечки.
+# Учитываются все сессии класса TrackedSession, то есть все, созданные фабриками
+# из config.py, - в том числе открытые напрямую (SessionLocal()) в обход
+# session_scope, ведь именно такие сессии и утекают.
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from sqlalchemy.orm import Session
+
+
+class SessionTracker:
+    """Счетчики сессий TrackedSession; commit и rollback считаются в session_scope"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.committed = 0
+        self.rolled_back = 0
+        self.leaked = 0
+
+    def track(self, session):
+        """
+        Регистрирует открытую сессию
+        Возвращает функцию, которую нужно вызвать после закрытия сессии
+        """
+        with self._lock:
+            self.opened += 1
+        # Сработает, только если сессию удалят, не вызвав возвращенную функцию
+        finalizer = weakref.finalize(session, self._on_leak)
+
+        def closed():
+            # Сессию можно закрыть несколько раз - учитывается первое закрытие
+            if finalizer.detach() is None:
+                return
+            with self._lock:
+                self.closed += 1
+
+        return closed
+
+    def record(self, committed):
+        with self._lock:
+            if committed:
+                self.committed += 1
+            else:
+                self.rolled_back += 1
+
+    @property
+    def outstanding(self):
+        """Сколько сессий открыто и еще не закрыто"""
+        with self._lock:
+            return self.opened - self.closed - self.leaked
+
+    def stats(self):
+        """Снимок счетчиков"""
+        with self._lock:
+            return {
+                "opened": self.opened,
+                "closed": self.closed,
+                "outstanding": self.opened - self.closed - self.leaked,
+                "committed": self.committed,
+                "rolled_back": self.rolled_back,
+                "leaked": self.leaked,
+            }
+
+    def _on_leak(self):
+        with self._lock:
+            self.leaked += 1
+
+
+# Общий счетчик процесса
+tracker = SessionTracker()
+
+
+class TrackedSession(Session):
+    """
+    Session, которая регистрируется в tracker при создании и отмечается
+    закрытой в close(). Подключается к фабрикам:
+    sessionmaker(class_=TrackedSession) и
+    async_sessionmaker(sync_session_class=TrackedSession)
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tracker_closed = tracker.track(self)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._tracker_closed()
+
+
+@contextmanager
+def session_scope(factory):
+    """
+    Синхронная единица работы: with session_scope(SessionLocal) as db: ...
+    factory - фабрика сессий (sessionmaker)
+    """
+    session = factory()
+    try:
+        yield session
+        session.commit()
+        tracker.record(committed=True)
+    except BaseException:
+        session.rollback()
+        tracker.record(committed=False)
+        raise
+    finally:
+        session.close()
+
+
+@asynccontextmanager
+async def async_session_scope(factory):
+    """
+    Асинхронная единица работы: async with async_session_scope(AsyncSessionLocal) as db: ...
+    factory - фабрика асинхронных сессий (async_sessionmaker)
+    """
+    session = factory()
+    try:
+        yield session
+        await session.commit()
+        tracker.record(committed=True)
+    except BaseException:
+        await session.rollback()
+        tracker.record(committed=False)
+        raise
+    finally:
+        await session.close()
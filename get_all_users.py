@@ -1,14 +1,16 @@
 # Импорт необходимых модулей
+import argparse  # Для разбора аргументов командной строки
+import sys  # Для вывода экспорта в stdout
+import time  # Для замера скорости экспорта
+from contextlib import redirect_stdout  # Чтобы сообщения не смешивались с экспортом
 import psycopg2  # Основной драйвер для работы с PostgreSQL
 from psycopg2 import sql  # Для безопасного формирования SQL-запросов
 
-# Конфигурация подключения к базе данных (ЗАМЕНИТЕ ЭТИ ЗНАЧЕНИЯ НА СВОИ!)
-DB_NAME = ""  # Имя вашей БД
-DB_USER = "postgres"       # Пользователь (обычно postgres)
-DB_PASSWORD = ""  # Пароль, который вы задали при установке
-DB_HOST = "localhost"      # Хост (обычно localhost)
-DB_PORT = "5432"           # Порт (обычно 5432)
+import db_pool  # Общий пул соединений (настройки подключения - в файле .env)
+from pagination import DEFAULT_PAGE_SIZE, browse_pages  # Постраничный просмотр (keyset-пагинация)
 
+# Сколько строк серверный курсор передает за один сетевой запрос
+DEFAULT_ITERSIZE = 2000
 
 
 def fetch_all_users(conn, table_name):
@@ -34,43 +36,179 @@ def fetch_all_users(conn, table_name):
         return cursor.fetchall()
 
 
-def main():
-    # Инициализация переменной подключения
-    conn = None
+def iter_users(conn, table_name, itersize=DEFAULT_ITERSIZE, order_by_id=False):
+    """
+    Генератор: отдает записи таблицы по одной, не загружая всю таблицу в память
+    conn - активное подключение к базе данных
+    table_name - имя таблицы для запроса
+    itersize - сколько строк забирать с сервера за один раз
+    order_by_id - отсортировать записи по ID (как allin_alchemy.iter_users)
+    Выдает кортежи (id, name)
+    """
+    # Именованный курсор - серверный: результат запроса остается на стороне
+    # PostgreSQL, а клиент забирает его порциями по itersize строк.
+    # В памяти Python одновременно находится не больше одной порции.
+    with conn.cursor(name="iter_users") as cursor:
+        cursor.itersize = itersize
+        cursor.execute(
+            sql.SQL("SELECT id, name FROM {}{};")
+            .format(sql.Identifier(table_name),
+                    sql.SQL(" ORDER BY id" if order_by_id else "")))
 
-    try:
-        # Устанавливаем соединение с базой данных
-        conn = psycopg2.connect(
-            dbname=DB_NAME,  # Имя БД
-            user=DB_USER,  # Логин
-            password=DB_PASSWORD,  # Пароль
-            host=DB_HOST,  # Адрес сервера
-            port=DB_PORT  # Порт
-        )
-        print("✓ Подключение к PostgreSQL успешно установлено!")
-
-        # Запрашиваем имя таблицы у пользователя
-        table_name = input("Введите имя таблицы: ").strip()
-
-        # Получаем данные из таблицы
-        users = fetch_all_users(conn, table_name)
-
-        # Выводим результаты
-        if not users:  # Если список пуст
-            print(f"\nТаблица '{table_name}' не содержит записей.")
-        else:
-            # Форматируем вывод как таблицу
+        # Итерация по курсору сама подгружает следующую порцию,
+        # когда текущая закончилась
+        for row in cursor:
+            yield row
+
+
+def print_users(users):
+    """
+    Печатает записи в виде ASCII-таблицы по мере их поступления
+    users - любой итерируемый объект с кортежами (id, name), например генератор
+    Возвращает количество выведенных записей
+    """
+    count = 0
+    for user in users:
+        # Заголовок печатаем только когда пришла первая строка
+        if count == 0:
             print("\nСписок пользователей:")
             print("+" + "-" * 23 + "+")
             print("| {:^3} | {:^15} |".format("ID", "Имя"))  # Заголовки
             print("+" + "-" * 23 + "+")
 
-            # Выводим каждую запись
-            for user in users:
-                print("| {:^3} | {:<15} |".format(user[0], user[1]))
+        print("| {:^3} | {:<15} |".format(user[0], user[1]))
+        count += 1
 
-            print("+" + "-" * 23 + "+")
-            print(f"Всего записей: {len(users)}")
+    if count:
+        print("+" + "-" * 23 + "+")
+    return count
+
+
+def export_users(conn, table_name, out, fmt="csv", id_from=None, id_to=None, header=False):
+    """
+    Выгружает таблицу через COPY (SELECT ...) TO STDOUT прямо в файл
+    conn - активное подключение к базе данных
+    table_name - имя таблицы
+    out - файл, открытый в двоичном режиме ('wb'), или sys.stdout.buffer
+    fmt - "csv" или "binary" (двоичный формат PostgreSQL, для COPY FROM ... BINARY)
+    id_from, id_to - необязательный диапазон ID включительно; разные диапазоны
+                     можно выгружать параллельно несколькими процессами
+    header - добавить строку заголовка (только для CSV)
+    Возвращает количество выгруженных строк
+    """
+    # Условие по диапазону ID; числа подставляются как литералы,
+    # потому что в COPY нельзя передать параметры запроса
+    conditions = []
+    if id_from is not None:
+        conditions.append(sql.SQL("id >= {}").format(sql.Literal(id_from)))
+    if id_to is not None:
+        conditions.append(sql.SQL("id <= {}").format(sql.Literal(id_to)))
+    where = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+
+    if fmt == "binary":
+        options = sql.SQL("FORMAT binary")
+    else:
+        options = sql.SQL("FORMAT csv, HEADER {}").format(sql.SQL("true" if header else "false"))
+
+    query = sql.SQL("COPY (SELECT id, name FROM {}{}) TO STDOUT WITH ({});").format(
+        sql.Identifier(table_name), where, options)
+
+    # Данные идут с сервера в файл блоками, без разбора строк в Python
+    with conn.cursor() as cursor:
+        cursor.copy_expert(query, out)
+        count = cursor.rowcount
+    conn.commit()
+    return count
+
+
+def run_export(conn, args, stdout):
+    """
+    Выгружает таблицу в файл args.export ("-" - в stdout)
+    stdout - двоичный поток стандартного вывода (сообщения в это время идут в stderr)
+    """
+    table_name = args.table or input("Введите имя таблицы: ").strip()
+    started = time.perf_counter()
+    if args.export == "-":
+        count = export_users(conn, table_name, stdout, args.format,
+                             args.id_from, args.id_to, args.header)
+        stdout.flush()
+    else:
+        with open(args.export, "wb") as out:
+            count = export_users(conn, table_name, out, args.format,
+                                 args.id_from, args.id_to, args.header)
+    elapsed = time.perf_counter() - started
+    print(f"✓ Выгружено записей: {count} за {elapsed:.2f} с")
+
+
+def parse_args():
+    """Разбирает необязательные аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Просмотр записей таблицы PostgreSQL")
+    parser.add_argument("--table", help="имя таблицы (если не указано, будет запрошено)")
+    parser.add_argument("--itersize", type=int, default=DEFAULT_ITERSIZE,
+                        help="сколько строк забирать с сервера за один запрос")
+    parser.add_argument("--page-size", type=int,
+                        help="показывать таблицу постранично по указанному числу записей")
+    parser.add_argument("--page-token",
+                        help="токен страницы, с которой продолжить просмотр (например after:500)")
+    parser.add_argument("--export", metavar="PATH",
+                        help="выгрузить таблицу через COPY в файл ('-' - в stdout)")
+    parser.add_argument("--format", choices=("csv", "binary"), default="csv",
+                        help="формат выгрузки: csv или двоичный формат PostgreSQL")
+    parser.add_argument("--header", action="store_true",
+                        help="добавить в CSV строку заголовка")
+    parser.add_argument("--id-from", type=int, help="выгружать записи с ID не меньше указанного")
+    parser.add_argument("--id-to", type=int, help="выгружать записи с ID не больше указанного")
+    return parser.parse_args()
+
+
+def show_users(conn, args):
+    """
+    Выводит записи таблицы: постранично или целиком потоком
+    conn - активное подключение к базе данных
+    args - аргументы командной строки
+    """
+    # Запрашиваем имя таблицы у пользователя
+    table_name = args.table or input("Введите имя таблицы: ").strip()
+
+    # Постраничный режим: листаем таблицу командами n/p/q
+    if args.page_size or args.page_token:
+        token = browse_pages(conn, table_name, args.page_size or DEFAULT_PAGE_SIZE, args.page_token)
+        # None - в таблице нет записей, продолжать нечего
+        if token is not None:
+            print(f"Продолжить просмотр с этого места: --page-token {token}")
+        return
+
+    # Получаем данные потоком и сразу выводим их,
+    # поэтому память не растет вместе с размером таблицы
+    count = print_users(iter_users(conn, table_name, args.itersize))
+
+    # Выводим результаты
+    if not count:  # Если записей нет
+        print(f"\nТаблица '{table_name}' не содержит записей.")
+    else:
+        print(f"Всего записей: {count}")
+
+
+def main():
+    args = parse_args()
+
+    # При выгрузке в stdout все сообщения уходят в stderr
+    stdout = sys.stdout.buffer
+    with redirect_stdout(sys.stderr if args.export == "-" else sys.stdout):
+        run(args, stdout)
+
+
+def run(args, stdout):
+    """Подключается к базе и выполняет просмотр или выгрузку"""
+    try:
+        # Берем соединение из общего пула; при выходе из блока with
+        # оно возвращается в пул
+        with db_pool.connection() as conn:
+            print("✓ Подключение к PostgreSQL успешно установлено!")
+            if args.export:
+                run_export(conn, args, stdout)
+            else:
+                show_users(conn, args)
 
     except psycopg2.OperationalError as e:
         # Ошибки подключения (неверный пароль, сервер не доступен)
@@ -89,10 +227,9 @@ def main():
         print(f"× Неизвестная ошибка: {e}")
 
     finally:
-        # Всегда закрываем подключение, даже если была ошибка
-        if conn:
-            conn.close()
-            print("\n✓ Соединение с базой данных закрыто")
+        # Всегда закрываем соединения пула, даже если была ошибка
+        db_pool.close_pool()
+        print("\n✓ Соединение с базой данных закрыто")
 
 
 # Стандартная проверка для запуска из командной строки
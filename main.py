@@ -1,25 +1,59 @@
+import argparse
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
 from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+import db_pool  # Общий пул соединений, настройки подключения берутся из .env
+from schema_cache import ensure_schema
 
-# Настройки подключения (замените на свои)
-DB_NAME = ""  # Имя вашей БД
-DB_USER = "postgres"       # Пользователь (обычно postgres)
-DB_PASSWORD = ""  # Пароль, который вы задали при установке
-DB_HOST = "localhost"      # Хост (обычно localhost)
-DB_PORT = "5432"           # Порт (обычно 5432)
+# Версия DDL таблицы имен; увеличьте ее при изменении CREATE TABLE
+TABLE_SCHEMA_VERSION = 1
 
 def create_table_if_not_exists(conn, table_name):
-    """Создает таблицу, если её нет."""
+    """Создает таблицу, если её нет (DDL не повторяется для уже проверенной таблицы)."""
+    def create():
+        with conn.cursor() as cursor:
+            cursor.execute(
+                sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    id SERIAL PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL
+                );
+                """).format(sql.Identifier(table_name)))
+            conn.commit()
+
+    ensure_schema(conn, table_name, TABLE_SCHEMA_VERSION, create)
+    print(f"Таблица '{table_name}' готова!")
+
+@contextmanager
+def scratch_table(conn, table_name, suffix):
+    """
+    Временная копия структуры таблицы для замеров: <таблица>_<suffix>.
+    Удаляется при выходе из блока, поэтому замеры не добавляют строки в настоящую таблицу.
+    """
+    scratch = f"{table_name}_{suffix}"
     with conn.cursor() as cursor:
         cursor.execute(
             sql.SQL("""
-            CREATE TABLE IF NOT EXISTS {} (
+            DROP TABLE IF EXISTS {0};
+            CREATE TABLE {0} (
                 id SERIAL PRIMARY KEY,
                 name VARCHAR(100) NOT NULL
             );
-            """).format(sql.Identifier(table_name)))
+            """).format(sql.Identifier(scratch)))
+    conn.commit()
+    try:
+        yield scratch
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {};").format(sql.Identifier(scratch)))
         conn.commit()
-        print(f"Таблица '{table_name}' готова!")
 
 def insert_name(conn, table_name, name):
     """Добавляет имя в таблицу."""
@@ -33,35 +67,344 @@ def insert_name(conn, table_name, name):
         conn.commit()
         print(f"Добавлено имя '{name}' с ID = {inserted_id}")
 
-def main():
-    # Подключение к БД
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
-        )
-        print("Успешное подключение к PostgreSQL!")
+def prompt_names():
+    """Запрашивает имена с клавиатуры, пока не будет введено 'exit'."""
+    while True:
+        name = input("Введите имя (или 'exit' для выхода): ").strip()
+        if name.lower() == 'exit':
+            break
+        yield name
+
+def read_names(source):
+    """Читает имена построчно из файла или stdin, пропуская пустые строки."""
+    for line in source:
+        name = line.strip()
+        if name:
+            yield name
+
+def _escape_copy_value(value):
+    """Экранирует значение для текстового формата COPY."""
+    return (value.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
 
-        # Ввод имени таблицы с клавиатуры
-        table_name = input("Введите имя таблицы: ").strip()
-        create_table_if_not_exists(conn, table_name)
+class _CopyStream:
+    """
+    Файлоподобный объект для COPY ... FROM STDIN.
+    Берет имена из итератора только тогда, когда psycopg2 просит следующую
+    порцию данных, поэтому входной файл не загружается в память целиком.
+    """
 
-        # Ввод имени для добавления
-        while True:
-            name = input("Введите имя (или 'exit' для выхода): ").strip()
-            if name.lower() == 'exit':
+    def __init__(self, names):
+        self._names = iter(names)
+        self._buffer = ""
+        self.count = 0  # Сколько строк уже отдано в COPY
+
+    def _fill(self, size):
+        parts = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            name = next(self._names, None)
+            if name is None:
                 break
-            insert_name(conn, table_name, name)
+            line = _escape_copy_value(name) + "\n"
+            parts.append(line)
+            length += len(line)
+            self.count += 1
+        self._buffer = "".join(parts)
+
+    def read(self, size=-1):
+        self._fill(size)
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        if "\n" not in self._buffer:
+            self._fill(len(self._buffer) + 1)
+        end = self._buffer.find("\n") + 1 or len(self._buffer)
+        if 0 <= size < end:
+            end = size
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+def copy_names(conn, table_name, names, return_ids=False, commit=True):
+    """
+    Массово добавляет имена через COPY ... FROM STDIN в одной транзакции.
+    names - итерируемый объект со строками (список, генератор, файл)
+    return_ids - нужно ли вернуть присвоенные ID. COPY не умеет RETURNING,
+                 поэтому в этом режиме данные сначала идут во временную таблицу,
+                 а затем переносятся одним INSERT ... SELECT ... RETURNING id
+    commit - фиксировать ли транзакцию; False позволяет вызывающему коду
+             сделать в той же транзакции что-то еще
+    Возвращает кортеж (количество строк, список ID или None)
+    """
+    stream = _CopyStream(names)
+    try:
+        with conn.cursor() as cursor:
+            if not return_ids:
+                cursor.copy_expert(
+                    sql.SQL("COPY {} (name) FROM STDIN;")
+                    .format(sql.Identifier(table_name)),
+                    stream)
+                if commit:
+                    conn.commit()
+                return stream.count, None
+
+            cursor.execute("""
+                CREATE TEMP TABLE copy_names_buffer (
+                    ord BIGSERIAL,
+                    name VARCHAR(100) NOT NULL
+                ) ON COMMIT DROP;
+            """)
+            cursor.copy_expert("COPY copy_names_buffer (name) FROM STDIN;", stream)
+            cursor.execute(
+                sql.SQL("INSERT INTO {} (name) "
+                        "SELECT name FROM copy_names_buffer ORDER BY ord RETURNING id;")
+                .format(sql.Identifier(table_name)))
+            ids = [row[0] for row in cursor.fetchall()]
+            if commit:
+                conn.commit()
+            return stream.count, ids
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+
+def bulk_load(conn, table_name, path, return_ids=False):
+    """Загружает имена из файла (или stdin, если path == '-') и печатает статистику."""
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        started = time.perf_counter()
+        count, ids = copy_names(conn, table_name, read_names(source), return_ids)
+        elapsed = time.perf_counter() - started
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    rate = count / elapsed if elapsed > 0 else 0
+    print(f"Загружено строк: {count} за {elapsed:.2f} с ({rate:.0f} строк/с)")
+    if ids is not None:
+        for inserted_id in ids:
+            print(inserted_id)
+
+def _format_ids(ids):
+    """Сворачивает список ID в диапазоны: [1, 2, 3, 7] -> '1-3, 7'."""
+    ranges = []
+    for current in ids:
+        if ranges and current == ranges[-1][1] + 1:
+            ranges[-1][1] = current
+        else:
+            ranges.append([current, current])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+class BatchInserter:
+    """
+    Накапливает имена и добавляет их пачками.
+    Каждая пачка - это один многострочный INSERT ... VALUES (...), (...), ...
+    (execute_values) и один COMMIT. Пачка отправляется, когда набралось
+    batch_size имен или с момента появления первого имени в пачке прошло
+    commit_interval_ms миллисекунд. Время проверяется при добавлении очередного
+    имени и в flush_if_due(), которую insert_batched вызывает по таймеру из
+    отдельного потока - пока ввод ждет следующего имени. Методы защищены блокировкой.
+    """
 
+    def __init__(self, conn, table_name, batch_size=100, commit_interval_ms=1000):
+        self.conn = conn
+        self.table_name = table_name
+        self.batch_size = max(1, batch_size)
+        self.commit_interval = commit_interval_ms / 1000
+        self.rows = 0          # Сколько строк уже зафиксировано
+        self.batches = 0       # Сколько пачек (коммитов) выполнено
+        self.db_time = 0.0     # Суммарное время INSERT + COMMIT, секунды
+        self._pending = []
+        self._first_pending_at = None
+        self._lock = threading.Lock()
+        self._query = sql.SQL("INSERT INTO {} (name) VALUES %s RETURNING id;") \
+            .format(sql.Identifier(table_name))
+
+    def add(self, name):
+        """Добавляет имя в пачку. Возвращает ID, если пачка была отправлена, иначе []."""
+        with self._lock:
+            if not self._pending:
+                self._first_pending_at = time.perf_counter()
+            self._pending.append(name)
+            if len(self._pending) >= self.batch_size or self._due():
+                return self._flush()
+            return []
+
+    def flush_if_due(self):
+        """Отправляет неполную пачку, если она ждет дольше commit_interval_ms."""
+        with self._lock:
+            return self._flush() if self._due() else []
+
+    def flush(self):
+        """Отправляет накопленные имена одной командой и фиксирует транзакцию."""
+        with self._lock:
+            return self._flush()
+
+    def _due(self):
+        return bool(self._pending) and \
+            time.perf_counter() - self._first_pending_at >= self.commit_interval
+
+    def _flush(self):
+        if not self._pending:
+            return []
+        names, self._pending = self._pending, []
+        started = time.perf_counter()
+        try:
+            with self.conn.cursor() as cursor:
+                rows = execute_values(
+                    cursor, self._query.as_string(self.conn),
+                    [(name,) for name in names],
+                    page_size=len(names), fetch=True)
+            self.conn.commit()
+        except psycopg2.Error:
+            self.conn.rollback()
+            raise
+        self.db_time += time.perf_counter() - started
+        self.rows += len(names)
+        self.batches += 1
+        return [row[0] for row in rows]
+
+def insert_batched(conn, table_name, names, batch_size=100, commit_interval_ms=1000):
+    """
+    Добавляет имена через BatchInserter и печатает ID каждой отправленной пачки.
+    Возвращает словарь со статистикой прогона.
+    """
+    inserter = BatchInserter(conn, table_name, batch_size, commit_interval_ms)
+    started = time.perf_counter()
+
+    def report(ids):
+        if ids:
+            print(f"Пачка #{inserter.batches}: добавлено {len(ids)} имен, ID {_format_ids(ids)}")
+
+    # Пока чтение ждет следующего имени (медленный конвейер, клавиатура),
+    # неполная пачка отправляется по истечении commit_interval_ms
+    stop = threading.Event()
+
+    def flush_on_time():
+        while not stop.wait(min(inserter.commit_interval, 0.1)):
+            try:
+                report(inserter.flush_if_due())
+            except psycopg2.Error as e:
+                print(f"Ошибка отправки пачки по таймеру: {e}")
+                return
+
+    timer = threading.Thread(target=flush_on_time, daemon=True)
+    timer.start()
+    try:
+        for name in names:
+            report(inserter.add(name))
+    finally:
+        stop.set()
+        timer.join()
+        # Хвост пачки отправляется и при прерывании (Ctrl+C, ошибка чтения)
+        report(inserter.flush())
+
+    elapsed = time.perf_counter() - started
+    return {
+        "batch_size": inserter.batch_size,
+        "rows": inserter.rows,
+        "batches": inserter.batches,
+        "seconds": elapsed,
+        "db_seconds": inserter.db_time,
+    }
+
+def print_batch_summary(results):
+    """Печатает сводку пропускной способности для каждого размера пачки."""
+    print("\nСводка по размерам пачки:")
+    print("+" + "-" * 57 + "+")
+    print("| {:>7} | {:>9} | {:>8} | {:>9} | {:>10} |".format(
+        "Пачка", "Строк", "Коммитов", "Секунд", "Строк/с"))
+    print("+" + "-" * 57 + "+")
+    for result in results:
+        rate = result["rows"] / result["db_seconds"] if result["db_seconds"] > 0 else 0
+        print("| {:>7} | {:>9} | {:>8} | {:>9.2f} | {:>10.0f} |".format(
+            result["batch_size"], result["rows"], result["batches"],
+            result["db_seconds"], rate))
+    print("+" + "-" * 57 + "+")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Добавление имен в таблицу PostgreSQL")
+    parser.add_argument("--table", help="имя таблицы (если не указано, будет запрошено)")
+    parser.add_argument("--bulk", metavar="FILE",
+                        help="массовая загрузка имен из файла через COPY ('-' - читать stdin)")
+    parser.add_argument("--return-ids", action="store_true",
+                        help="в режиме --bulk вывести ID добавленных строк")
+    parser.add_argument("--input", metavar="FILE",
+                        help="файл с именами для пакетной вставки (по умолчанию stdin или клавиатура)")
+    parser.add_argument("--batch-size", default="100",
+                        help="сколько имен отправлять одним INSERT и одним COMMIT; "
+                             "несколько значений через запятую (например 1,10,100) "
+                             "прогоняют --input для каждого и печатают сравнение")
+    parser.add_argument("--commit-interval-ms", type=int, default=1000,
+                        help="максимальное время ожидания неполной пачки, мс")
+    args = parser.parse_args()
+    if args.bulk == "-" and not args.table:
+        parser.error("при чтении имен из stdin укажите --table")
+    try:
+        args.batch_sizes = [int(size) for size in args.batch_size.split(",")]
+    except ValueError:
+        parser.error("--batch-size должен быть числом или списком чисел через запятую")
+    if len(args.batch_sizes) > 1 and not args.input:
+        parser.error("для сравнения нескольких размеров пачки укажите --input")
+    if not args.table and not args.input and not sys.stdin.isatty():
+        parser.error("при чтении имен из stdin укажите --table")
+    return args
+
+def load(conn, args):
+    """Создает таблицу и добавляет в нее имена выбранным способом."""
+    # Ввод имени таблицы с клавиатуры
+    table_name = args.table or input("Введите имя таблицы: ").strip()
+    create_table_if_not_exists(conn, table_name)
+
+    # Массовая загрузка из файла
+    if args.bulk:
+        bulk_load(conn, table_name, args.bulk, args.return_ids)
+        return
+
+    results = []
+    if args.input and len(args.batch_sizes) > 1:
+        # Сравнение размеров пачки: файл читается заново для каждого размера и
+        # загружается во временную таблицу, чтобы имена не добавлялись
+        # в настоящую таблицу по нескольку раз
+        for batch_size in args.batch_sizes:
+            with open(args.input, encoding="utf-8") as source, \
+                    scratch_table(conn, table_name, f"batch_{batch_size}") as scratch:
+                results.append(insert_batched(
+                    conn, scratch, read_names(source),
+                    batch_size, args.commit_interval_ms))
+    elif args.input:
+        # Имена из файла
+        with open(args.input, encoding="utf-8") as source:
+            results.append(insert_batched(
+                conn, table_name, read_names(source),
+                args.batch_sizes[0], args.commit_interval_ms))
+    else:
+        # Имена из конвейера (stdin) или с клавиатуры. С клавиатуры каждое имя
+        # сохраняется сразу: пока программа ждет ввода, пачка не может отправиться
+        # по времени, и введенное имя не попало бы в базу до следующего
+        interactive = sys.stdin.isatty()
+        names = prompt_names() if interactive else read_names(sys.stdin)
+        results.append(insert_batched(
+            conn, table_name, names,
+            1 if interactive else args.batch_sizes[0], args.commit_interval_ms))
+    print_batch_summary(results)
+
+def main():
+    args = parse_args()
+    # Подключение к БД
+    try:
+        with db_pool.connection() as conn:
+            print("Успешное подключение к PostgreSQL!")
+            load(conn, args)
     except Exception as e:
         print(f"Ошибка: {e}")
     finally:
-        if conn:
-            conn.close()
-            print("Соединение закрыто.")
+        db_pool.close_pool()
+        print("Соединение закрыто.")
 
 if __name__ == "__main__":
     main()
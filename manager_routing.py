@@ -0,0 +1,115 @@
+# Таблица маршрутизации "тема -> менеджер" в памяти процесса
+#
+# Менеджеров мало, и меняются они редко, поэтому бот не запрашивает их из базы
+# на каждое обращение: таблица загружается при запуске и перечитывается,
+# когда устарела (MANAGER_ROUTING_REFRESH секунд, по умолчанию 300;
+# 0 - только при явном сбросе) или после invalidate() - например, когда
+# менеджеры изменились или администратор отправил команду обновления.
+# Обработчик обновляет таблицу (refresh) до того, как займет соединение для
+# своей сессии, а сам поиск (route) к базе не обращается. Если перечитать
+# таблицу не удалось, используется прежняя, а следующая попытка будет через
+# MANAGER_ROUTING_RETRY секунд (по умолчанию 5).
+import asyncio
+import os
+import time
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from db_session import async_session_scope
+from models import Manager
+
+REFRESH_INTERVAL = float(os.getenv("MANAGER_ROUTING_REFRESH", "300"))
+RETRY_INTERVAL = float(os.getenv("MANAGER_ROUTING_RETRY", "5"))
+
+# Данные менеджера, нужные для маршрутизации (не объект ORM - не привязан к сессии)
+ManagerRoute = namedtuple("ManagerRoute", ["id", "vk_id", "name"])
+
+
+class ManagerRouting:
+    """
+    Маршрутизация обращений по темам
+    session_factory - фабрика асинхронных сессий (AsyncSessionLocal)
+    refresh_interval - через сколько секунд таблица считается устаревшей
+    retry_interval - через сколько секунд повторить неудачную загрузку
+    """
+
+    def __init__(self, session_factory, refresh_interval=REFRESH_INTERVAL,
+                 retry_interval=RETRY_INTERVAL):
+        self.session_factory = session_factory
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self._routes = {}  # Topic -> ManagerRoute
+        self._vk_ids = frozenset()
+        self._loaded_at = None
+        self._retry_at = None  # после неудачной загрузки - не перечитывать до этого времени
+        self._lock = asyncio.Lock()
+        self.loads = 0
+        self.failures = 0
+
+    @property
+    def stale(self):
+        """Нужно ли перечитать таблицу из базы"""
+        if self._retry_at is not None and time.monotonic() < self._retry_at:
+            return False
+        if self._loaded_at is None:
+            return True
+        return self.refresh_interval > 0 and \
+            time.monotonic() - self._loaded_at > self.refresh_interval
+
+    async def load(self):
+        """Читает менеджеров из базы; на тему назначается менеджер с меньшим ID"""
+        async with async_session_scope(self.session_factory) as db:
+            rows = (await db.execute(
+                select(Manager.id, Manager.vk_id, Manager.name, Manager.topic).order_by(Manager.id)
+            )).all()
+
+        routes = {}
+        for row in rows:
+            routes.setdefault(row.topic, ManagerRoute(row.id, row.vk_id, row.name))
+        # Подмена целиком: читатели видят либо старую, либо новую таблицу
+        self._routes = routes
+        self._vk_ids = frozenset(row.vk_id for row in rows)
+        self._loaded_at = time.monotonic()
+        self._retry_at = None
+        self.loads += 1
+        return len(routes)
+
+    def invalidate(self):
+        """Помечает таблицу устаревшей; она перечитается при следующем обращении"""
+        self._loaded_at = None
+        self._retry_at = None
+
+    async def refresh(self):
+        """
+        Перечитывает таблицу, если она устарела. Вызывается до того, как обработчик
+        откроет свою сессию: иначе при всплеске обращений все соединения пула заняты
+        обработчиками, которые ждут загрузку, а загрузке не достается соединения.
+        Ошибка загрузки не передается вызывающему - остается прежняя таблица
+        """
+        if not self.stale:
+            return
+        # Одновременные обращения не должны перечитывать таблицу по несколько раз
+        async with self._lock:
+            if not self.stale:
+                return
+            try:
+                await self.load()
+            except Exception as e:
+                self.failures += 1
+                self._retry_at = time.monotonic() + self.retry_interval
+                print(f"Не удалось обновить список менеджеров, используется прежний: {e}")
+
+    def route(self, topic):
+        """Менеджер (ManagerRoute) для темы или None; к базе не обращается"""
+        return self._routes.get(topic)
+
+    async def get(self, topic):
+        """Менеджер (ManagerRoute) для темы или None"""
+        await self.refresh()
+        return self.route(topic)
+
+    async def is_manager(self, vk_id):
+        """Является ли пользователь ВК менеджером"""
+        await self.refresh()
+        return vk_id in self._vk_ids
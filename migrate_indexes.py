@@ -0,0 +1,236 @@
+# Добавление индексов из models.py в уже существующую базу бота
+#
+# Base.metadata.create_all создает индексы только вместе с новыми таблицами,
+# поэтому для существующих таблиц appeals и managers индексы создаются здесь:
+# CREATE INDEX CONCURRENTLY IF NOT EXISTS - без блокировки записи в таблицу,
+# бот может продолжать работать. Индекс, оставшийся невалидным после
+# прерванного CONCURRENTLY, удаляется и создается заново.
+# Перед уникальным индексом по managers.vk_id проверяются дубликаты:
+# если они есть, индекс не создается, а дубликаты выводятся.
+# Колонки, добавленные в модели позже таблиц (NEW_COLUMNS), добавляются
+# через ADD COLUMN IF NOT EXISTS.
+#
+# Индексы, убранные из моделей (OBSOLETE_INDEXES), удаляются так же CONCURRENTLY.
+#
+# Для оценки эффекта:
+#   --seed N      - добавить N тестовых обращений (text = '[seed]')
+#   --explain     - EXPLAIN (ANALYZE, BUFFERS) горячих запросов до и после миграции.
+#                   Запросы выполняются как в боте - подготовленными, с параметрами,
+#                   и с общим планом (plan_cache_mode = force_generic_plan): asyncpg
+#                   переходит на него после нескольких выполнений запроса.
+#                   Перед каждым EXPLAIN статистика обновляется (ANALYZE). Если
+#                   индексы моделей уже есть (например, create_all только что
+#                   создал таблицы вместе с ними), сравнивать не с чем - выводится
+#                   только текущий план
+#   --unseed      - удалить тестовые обращения
+#
+#     python migrate_indexes.py --seed 1000000 --explain
+import argparse
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateIndex
+
+from config import engine
+from models import Appeal, Base, Manager
+
+SEED_TEXT = "[seed]"
+
+# Колонки, которых нет в таблицах, созданных прежними версиями моделей
+NEW_COLUMNS = (
+    "ALTER TABLE outbound_messages ADD COLUMN IF NOT EXISTS dead boolean NOT NULL DEFAULT false",
+)
+
+# Индексы прежних версий моделей, которые больше не нужны
+OBSOLETE_INDEXES = ("ix_appeals_new_student_id",)
+
+# Запросы бота, для которых создаются индексы: имя -> (типы параметров, запрос, значения)
+HOT_QUERIES = {
+    "appeal_handler": ("(integer, status)",
+                       "SELECT * FROM appeals WHERE student_id = $1 AND status = $2 LIMIT 1",
+                       "1000005000, 'NEW'"),
+    "get_manager_by_topic": ("(topic)", "SELECT * FROM managers WHERE topic = $1 LIMIT 1",
+                             "'LIFE'"),
+    "manager_by_vk_id": ("(integer)", "SELECT * FROM managers WHERE vk_id = $1 LIMIT 1",
+                         "422634178"),
+}
+
+
+def model_indexes():
+    """Индексы, объявленные в моделях"""
+    return sorted(Appeal.__table__.indexes | Manager.__table__.indexes, key=lambda i: i.name)
+
+
+def index_ddl(index):
+    """CREATE [UNIQUE] INDEX CONCURRENTLY IF NOT EXISTS ... для индекса модели"""
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+    return ddl.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+
+
+def duplicate_vk_ids(conn):
+    """vk_id, которые встречаются у нескольких менеджеров"""
+    return conn.execute(text(
+        "SELECT vk_id, count(*) FROM managers GROUP BY vk_id HAVING count(*) > 1 ORDER BY vk_id"
+    )).all()
+
+
+def index_state(conn, name):
+    """None - индекса нет, True - валидный, False - невалидный (прерванный CONCURRENTLY)"""
+    return conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"
+    ), {"name": name}).scalar()
+
+
+def migrate(conn):
+    """
+    Добавляет недостающие колонки и индексы; conn - соединение в режиме AUTOCOMMIT
+    (CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции)
+    Возвращает False, если какой-то индекс создать не удалось
+    """
+    ok = True
+    for statement in NEW_COLUMNS:
+        conn.execute(text(statement))
+
+    for index in model_indexes():
+        if index.unique and index.table.name == "managers":
+            duplicates = duplicate_vk_ids(conn)
+            if duplicates:
+                print(f"× {index.name}: у нескольких менеджеров одинаковый vk_id, "
+                      f"индекс не создан. Удалите дубликаты:")
+                for vk_id, count in duplicates:
+                    print(f"  vk_id {vk_id}: {count} записей")
+                ok = False
+                continue
+
+        state = index_state(conn, index.name)
+        if state:
+            print(f"✓ {index.name} уже есть")
+            continue
+        if state is False:
+            print(f"  {index.name} невалиден после прерванной сборки - пересоздаем")
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+
+        try:
+            conn.execute(text(index_ddl(index)))
+            print(f"✓ {index.name} создан")
+        except SQLAlchemyError as e:
+            print(f"× {index.name}: {e}")
+            ok = False
+
+    for name in OBSOLETE_INDEXES:
+        if index_state(conn, name) is not None:
+            conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+            print(f"✓ {name} больше не нужен - удален")
+    return ok
+
+
+def seed(conn, count):
+    """Добавляет count тестовых обращений от 10000 студентов одним INSERT ... SELECT"""
+    conn.execute(text("""
+        INSERT INTO appeals (student_id, topic, text, status)
+        SELECT 1000000000 + (random() * 10000)::int,
+               (ARRAY['LIFE', 'SCHOLARSHIP', 'STUDY', 'SPORT', 'INTERNATIONAL'])[1 + n % 5]::topic,
+               :text,
+               -- большинство обращений уже решено, новых - около 5%
+               (CASE WHEN n % 20 = 0 THEN 'NEW' WHEN n % 20 = 1 THEN 'IN_PROGRESS'
+                     ELSE 'RESOLVED' END)::status
+        FROM generate_series(1, :count) AS n
+    """), {"text": SEED_TEXT, "count": count})
+    analyze(conn)
+    print(f"✓ Добавлено тестовых обращений: {count}")
+
+
+def unseed(conn):
+    """Удаляет тестовые обращения"""
+    result = conn.execute(text("DELETE FROM appeals WHERE text = :text"), {"text": SEED_TEXT})
+    print(f"✓ Удалено тестовых обращений: {result.rowcount}")
+
+
+def analyze(conn):
+    """Обновляет статистику планировщика для appeals и managers"""
+    conn.execute(text("ANALYZE appeals"))
+    conn.execute(text("ANALYZE managers"))
+
+
+def missing_indexes(conn):
+    """Имена индексов моделей, которых нет в базе или которые невалидны"""
+    return [index.name for index in model_indexes() if not index_state(conn, index.name)]
+
+
+def explain(conn):
+    """
+    Выполняет горячие запросы через PREPARE и EXPLAIN (ANALYZE, BUFFERS) EXECUTE
+    с общим планом, как их в итоге выполняет бот; возвращает {запрос: план}
+    """
+    plans = {}
+    conn.execute(text("SET plan_cache_mode = force_generic_plan"))
+    try:
+        for name, (types, query, values) in HOT_QUERIES.items():
+            conn.execute(text(f"PREPARE {name} {types} AS {query}"))
+            try:
+                plans[name] = conn.execute(
+                    text(f"EXPLAIN (ANALYZE, BUFFERS) EXECUTE {name}({values})")
+                ).scalars().all()
+            finally:
+                conn.execute(text(f"DEALLOCATE {name}"))
+    finally:
+        conn.execute(text("RESET plan_cache_mode"))
+    return plans
+
+
+def print_plans(title, plans):
+    """Выводит первую строку плана (узел и стоимость) и время выполнения"""
+    print(f"\n{title}:")
+    for name, rows in plans.items():
+        timing = next((row.strip() for row in rows if row.strip().startswith("Execution Time")), "")
+        print(f"  {name}: {rows[0].strip()}")
+        print(f"    {timing}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Индексы для таблиц appeals и managers")
+    parser.add_argument("--seed", type=int, metavar="N", help="добавить N тестовых обращений")
+    parser.add_argument("--explain", action="store_true",
+                        help="сравнить планы горячих запросов до и после миграции")
+    parser.add_argument("--unseed", action="store_true", help="удалить тестовые обращения")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        # Таблицы (без индексов, если таблицы уже были) должны существовать
+        Base.metadata.create_all(bind=engine)
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if args.seed:
+                seed(conn, args.seed)
+            # План "до" имеет смысл, только пока индексов действительно нет:
+            # на новой базе create_all уже создал их вместе с таблицами
+            before = None
+            if args.explain and missing_indexes(conn):
+                analyze(conn)
+                before = explain(conn)
+
+            ok = migrate(conn)
+
+            if args.explain:
+                analyze(conn)
+                after = explain(conn)
+                if before is None:
+                    print("\nИндексы моделей уже были до миграции - сравнивать не с чем")
+                    print_plans("Текущие планы", after)
+                else:
+                    print_plans("До миграции", before)
+                    print_plans("После миграции", after)
+            if args.unseed:
+                unseed(conn)
+    except SQLAlchemyError as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, Enum, ForeignKey, Index, DateTime, false, func
 from sqlalchemy.orm import relationship, declarative_base
 from enum import Enum as PyEnum
 
@@ -31,6 +31,14 @@ class Appeal(Base):
 
     manager = relationship("Manager", back_populates="appeals")
 
+    # Индексы под запросы бота; для существующей базы - migrate_indexes.py
+    __table_args__ = (
+        # appeal_handler: обращения студента с нужным статусом
+        # (частичный индекс WHERE status = 'NEW' не подходит: бот передает статус
+        # параметром, и общий план подготовленного запроса asyncpg его не использует)
+        Index("ix_appeals_student_id_status", "student_id", "status"),
+    )
+
 class Manager(Base):
     __tablename__ = 'managers'
 
@@ -40,3 +48,26 @@ class Manager(Base):
     topic = Column(Enum(Topic), nullable=False)
 
     appeals = relationship("Appeal", back_populates="manager")
+
+    __table_args__ = (
+        # get_manager_by_topic
+        Index("ix_managers_topic", "topic"),
+        # Поиск менеджера по vk_id при запуске; один vk_id - один менеджер
+        Index("ux_managers_vk_id", "vk_id", unique=True),
+    )
+
+
+class OutboundMessage(Base):
+    """Сообщение ВК, которое не удалось доставить (см. outbox.py); отправляется повторно"""
+    __tablename__ = 'outbound_messages'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    text = Column(String(4096), nullable=False)
+    # random_id ВК: повторная отправка с тем же значением не создаст дубликат
+    random_id = Column(Integer, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String(500))
+    # Доставить нельзя (запрет сообщений или исчерпаны попытки) - повторно не отправляется
+    dead = Column(Boolean, nullable=False, default=False, server_default=false())
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
\ No newline at end of file
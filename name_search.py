@@ -0,0 +1,139 @@
+# Поиск пользователей по имени: по началу имени и нечеткий (по триграммам)
+#
+# Поиск по началу имени (LIKE 'абв%') использует B-tree индекс
+# с классом операторов text_pattern_ops - обычный индекс по name для LIKE
+# не подходит, если правила сортировки базы не "C".
+# Нечеткий поиск использует расширение pg_trgm и GIN индекс по триграммам:
+# имя находится, даже если в запросе опечатка или это часть имени.
+# Сравнивается сходство запроса с самым похожим словом имени (word_similarity,
+# оператор <%), а не со всем именем - иначе короткий фрагмент длинного имени
+# не набирает порога сходства.
+# Если pg_trgm недоступно (нет прав на CREATE EXTENSION), нечеткий поиск
+# выполняется через ILIKE '%...%' полным просмотром таблицы.
+#
+# Индексы создаются при первом поиске командой CREATE INDEX CONCURRENTLY -
+# без блокировки записи в таблицу, но и не внутри транзакции (в режиме
+# autocommit). Индекс, оставшийся невалидным после прерванной сборки,
+# удаляется и создается заново.
+import psycopg2
+from psycopg2 import sql
+
+from schema_cache import ensure_schema
+
+# Версия индексов поиска; увеличьте ее при изменении DDL ниже
+NAME_SEARCH_SCHEMA_VERSION = 1
+
+# Сколько найденных пользователей возвращать по умолчанию
+DEFAULT_LIMIT = 20
+
+# Режимы поиска
+PREFIX = "prefix"
+FUZZY = "fuzzy"
+
+# Таблица -> доступен ли pg_trgm (проверяется один раз за процесс)
+_trigram = {}
+
+
+def escape_like(value):
+    """Экранирует спецсимволы LIKE (\\, % и _), чтобы они искались буквально"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def cached_trigram(table_name):
+    """
+    Доступен ли нечеткий поиск по индексу, если индексы таблицы уже проверены
+    в этом процессе; None - еще не проверены (нужен ensure_name_search_indexes)
+    """
+    return _trigram.get(table_name)
+
+
+def _create_index_concurrently(cursor, name, definition):
+    """CREATE INDEX CONCURRENTLY, если валидного индекса name еще нет"""
+    cursor.execute("SELECT i.indisvalid FROM pg_index i "
+                   "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s;", (name,))
+    row = cursor.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {};")
+                       .format(sql.Identifier(name)))
+    cursor.execute(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ").format(sql.Identifier(name))
+                   + definition)
+
+
+def ensure_name_search_indexes(conn, table_name):
+    """
+    Создает индексы для поиска по имени, если они еще не проверены
+    conn - DB-API соединение (psycopg2 или engine.raw_connection() SQLAlchemy)
+    table_name - имя таблицы с колонкой name
+    Возвращает True, если доступен нечеткий поиск по индексу (pg_trgm)
+    """
+    if table_name in _trigram:
+        return _trigram[table_name]
+
+    table = sql.Identifier(table_name)
+    # У engine.raw_connection() режим autocommit задается у самого соединения psycopg2
+    dbapi_conn = getattr(conn, "dbapi_connection", conn)
+
+    def create():
+        # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+        conn.commit()
+        autocommit = dbapi_conn.autocommit
+        dbapi_conn.autocommit = True
+        try:
+            with dbapi_conn.cursor() as cursor:
+                _create_index_concurrently(cursor, f"{table_name}_name_prefix_idx",
+                                           sql.SQL("ON {} (name text_pattern_ops);").format(table))
+                # Расширение может быть недоступно - тогда поиск идет без индекса
+                try:
+                    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+                    _create_index_concurrently(cursor, f"{table_name}_name_trgm_idx",
+                                               sql.SQL("ON {} USING gin (name gin_trgm_ops);")
+                                               .format(table))
+                except psycopg2.Error as e:
+                    print(f"pg_trgm недоступно, нечеткий поиск будет без индекса: {e}")
+        finally:
+            dbapi_conn.autocommit = autocommit
+
+    ensure_schema(conn, f"{table_name}_name_search", NAME_SEARCH_SCHEMA_VERSION, create)
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm');")
+        _trigram[table_name] = cursor.fetchone()[0]
+    conn.commit()
+    return _trigram[table_name]
+
+
+def search_users(conn, table_name, query, mode=PREFIX, limit=DEFAULT_LIMIT):
+    """
+    Ищет пользователей по имени
+    conn - активное подключение к базе данных
+    table_name - имя таблицы
+    query - начало имени (PREFIX) или произвольный фрагмент (FUZZY)
+    limit - максимальное число результатов
+    Возвращает список кортежей (id, name): для PREFIX - по алфавиту,
+    для FUZZY - от самых похожих
+    """
+    trigram = ensure_name_search_indexes(conn, table_name)
+    table = sql.Identifier(table_name)
+
+    with conn.cursor() as cursor:
+        if mode == PREFIX:
+            cursor.execute(
+                sql.SQL("SELECT id, name FROM {} WHERE name LIKE %s ORDER BY name LIMIT %s;")
+                .format(table),
+                (escape_like(query) + "%", limit))
+        elif trigram:
+            # <% - оператор pg_trgm "похоже на слово имени"
+            # (порог pg_trgm.word_similarity_threshold); в psycopg2 % записывается как %%
+            cursor.execute(
+                sql.SQL("SELECT id, name FROM {} WHERE %s <%% name "
+                        "ORDER BY word_similarity(%s, name) DESC, id LIMIT %s;")
+                .format(table),
+                (query, query, limit))
+        else:
+            cursor.execute(
+                sql.SQL("SELECT id, name FROM {} WHERE name ILIKE %s ORDER BY name LIMIT %s;")
+                .format(table),
+                ("%" + escape_like(query) + "%", limit))
+        return cursor.fetchall()
@@ -0,0 +1,377 @@
+# Очередь исходящих сообщений ВК для bot.py
+#
+# Транзакционный outbox: обработчик не ждет ответа API ВК, а вызывает
+# stage(db, ...) - строка outbound_messages добавляется в его же сессию и
+# фиксируется одним COMMIT вместе с изменениями обращения. После COMMIT
+# сообщение сразу ставится в ограниченную asyncio.Queue, а отправляют его
+# фоновые задачи-воркеры:
+# - общий для всех воркеров token bucket ограничивает частоту запросов
+#   (у сообщества ВК лимит около 20 запросов в секунду);
+# - при ошибке отправка повторяется с экспоненциальной задержкой;
+# - отправленное сообщение удаляется из таблицы. Все остальные - не
+#   поместившиеся в очередь, ожидающие повтора, оставшиеся после остановки
+#   или падения процесса - остаются в таблице; воркеры забирают их при запуске
+#   и затем раз в OUTBOX_POLL секунд, пока в очереди есть место;
+# - сообщение, которое доставить нельзя (пользователь запретил сообщения) или
+#   не удалось за OUTBOX_MAX_ATTEMPTS попыток (считаются и попытки до
+#   перезапуска), остается в таблице с пометкой dead и больше не отправляется.
+# Одно и то же сообщение могут отправить дважды (например, процесс упал между
+# отправкой и удалением строки), но random_id у него всегда один и тот же,
+# и ВК второй раз его не доставит.
+#
+# Переменные окружения:
+#   OUTBOX_QUEUE_SIZE - размер очереди (по умолчанию 1000)
+#   OUTBOX_WORKERS - число воркеров (4)
+#   OUTBOX_RATE - запросов к API в секунду (20)
+#   OUTBOX_MAX_ATTEMPTS - попыток отправки одного сообщения (5)
+#   OUTBOX_BACKOFF - первая задержка перед повтором, с (0.5); дальше удваивается
+#   OUTBOX_BACKOFF_MAX - максимальная задержка перед повтором, с (30)
+#   OUTBOX_POLL - как часто проверять outbound_messages, с (30)
+import asyncio
+import math
+import os
+import random
+import time
+from collections import deque
+
+from sqlalchemy import delete, event, inspect, select, update
+
+from db_session import async_session_scope
+from models import OutboundMessage
+
+QUEUE_SIZE = int(os.getenv("OUTBOX_QUEUE_SIZE", "1000"))
+WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+RATE = float(os.getenv("OUTBOX_RATE", "20"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+BACKOFF = float(os.getenv("OUTBOX_BACKOFF", "0.5"))
+BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "30"))
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL", "30"))
+
+# Коды ошибок ВК, при которых повтор бесполезен (пользователь запретил сообщения и т.п.)
+PERMANENT_ERROR_CODES = {900, 901, 902}
+
+# Ключ session.info: сообщения, добавленные stage() в еще не зафиксированной транзакции
+_STAGED = "outbox_staged"
+
+
+class OutgoingMessage:
+    """Сообщение в очереди; stored_id - ID его строки outbound_messages"""
+
+    def __init__(self, user_id, text, random_id=None, attempts=0, stored_id=None):
+        self.user_id = user_id
+        self.text = text
+        # Один random_id на все попытки: ВК не доставит сообщение дважды
+        self.random_id = random_id or random.randint(1, 2 ** 31 - 1)
+        self.attempts = attempts
+        self.stored_id = stored_id
+        self.error = None
+        self.dead = False
+
+
+class TokenBucket:
+    """Не больше rate операций в секунду, всплеск - до burst операций подряд"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class OutboundDispatcher:
+    """
+    Очередь исходящих сообщений с воркерами
+    send - корутина send(user_id, text, random_id), которая отправляет одно сообщение
+    session_factory - фабрика асинхронных сессий для таблицы outbound_messages
+    """
+
+    def __init__(self, send, session_factory, queue_size=QUEUE_SIZE, workers=WORKERS,
+                 rate=RATE, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF, backoff_max=BACKOFF_MAX,
+                 poll_interval=POLL_INTERVAL):
+        self.send = send
+        self.session_factory = session_factory
+        self.queue_size = queue_size
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.bucket = TokenBucket(rate)
+        self.queue = None
+        self._tasks = []
+        self._retries = {}  # задача ожидания повтора -> сообщение
+        self._in_flight = set()  # сообщения, которые воркеры отправляют прямо сейчас
+        # ID строк outbound_messages, сообщения которых сейчас в памяти
+        # (в очереди, отправляются или ждут повтора) - их не нужно читать снова
+        self._stored_ids = set()
+        self._running = False
+
+        # Метрики
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.overflowed = 0
+        self.persisted = 0
+        self.redelivered = 0
+        self._latencies = deque(maxlen=1000)  # время отправки последних сообщений, с
+
+    async def start(self):
+        """Запускает воркеры и ставит в очередь сохраненные ранее сообщения"""
+        # Очередь создается в работающем цикле событий
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._running = True
+        await self._redeliver()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._poll()))
+
+    async def stop(self, timeout=5.0):
+        """
+        Останавливает воркеры: ждет до timeout секунд, пока очередь опустеет.
+        Оставшиеся и ожидающие повтора сообщения уже есть в таблице - для них
+        сохраняются только счетчик попыток и последняя ошибка
+        """
+        self._running = False
+        if self.queue is None:
+            # start() не вызывался
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        # Отмененная задача повтора убирает себя из _retries - запоминаем сообщения заранее
+        retries = dict(self._retries)
+        for task in self._tasks + list(retries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *retries, return_exceptions=True)
+
+        # Прерванные отправки тоже сохраняются: если сообщение все же ушло,
+        # тот же random_id не даст ВК доставить его второй раз
+        left = list(self._in_flight) + list(retries.values())
+        self._in_flight.clear()
+        while not self.queue.empty():
+            left.append(self.queue.get_nowait())
+            self.queue.task_done()
+        self._retries.clear()
+        if left:
+            await self._persist(left)
+        self._stored_ids.clear()
+
+    def stage(self, db, user_id, text):
+        """
+        Добавляет сообщение в outbound_messages в транзакции обработчика
+        db - сессия обработчика (AsyncSession или Session); строка фиксируется
+             вместе с остальными изменениями, при откате ее не будет
+        После COMMIT сообщение сразу ставится в очередь (если в ней есть место
+        и воркеры запущены; иначе его заберет _poll или _redeliver при запуске)
+        """
+        message = OutgoingMessage(user_id, text)
+        row = OutboundMessage(user_id=user_id, text=text, random_id=message.random_id, attempts=0)
+        db.add(row)
+
+        session = getattr(db, "sync_session", db)
+        staged = session.info.get(_STAGED)
+        if staged is None:
+            # Обработчики событий подключаются один раз на сессию
+            staged = session.info[_STAGED] = []
+            event.listen(session, "after_commit", self._after_commit)
+            event.listen(session, "after_rollback", self._after_rollback)
+        staged.append((row, message))
+        self.persisted += 1
+        return row
+
+    def _after_commit(self, session):
+        # Строки уже в базе: ID назначен при flush перед COMMIT
+        staged = session.info.get(_STAGED) or []
+        ready, staged[:] = list(staged), []
+        for row, message in ready:
+            identity = inspect(row).identity
+            if identity is not None:
+                message.stored_id = identity[0]
+                self._enqueue_stored(message)
+
+    def _after_rollback(self, session):
+        # Откаченные строки не записаны - отправлять нечего
+        staged = session.info.get(_STAGED)
+        if staged:
+            staged.clear()
+
+    def _enqueue_stored(self, message):
+        """Ставит в очередь сообщение, строка которого уже есть в таблице"""
+        if not self._running or message.stored_id in self._stored_ids:
+            return False
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Строка остается в таблице - ее заберет _poll
+            self.overflowed += 1
+            return False
+        self._stored_ids.add(message.stored_id)
+        return True
+
+    def metrics(self):
+        """Снимок метрик очереди"""
+        latencies = sorted(self._latencies)
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "queue_size": self.queue_size,
+            "waiting_retry": len(self._retries),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "overflowed": self.overflowed,
+            "persisted": self.persisted,
+            "redelivered": self.redelivered,
+            "latency_avg": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p95": latencies[math.ceil(len(latencies) * 0.95) - 1] if latencies else 0.0,
+            "latency_max": latencies[-1] if latencies else 0.0,
+        }
+
+    def format_metrics(self):
+        """Метрики в виде текста (для команды бота и логов)"""
+        stats = self.metrics()
+        return (f"Очередь: {stats['queue_depth']} из {stats['queue_size']}, "
+                f"ждут повтора: {stats['waiting_retry']}\n"
+                f"Отправлено: {stats['sent']}, повторов: {stats['retried']}, "
+                f"не доставлено: {stats['failed']}, не поместилось в очередь: {stats['overflowed']}\n"
+                f"Сохранено в базу: {stats['persisted']}, отправлено из базы: {stats['redelivered']}\n"
+                f"Время отправки: в среднем {stats['latency_avg'] * 1000:.0f} мс, "
+                f"p95 {stats['latency_p95'] * 1000:.0f} мс, "
+                f"максимум {stats['latency_max'] * 1000:.0f} мс")
+
+    async def _worker(self):
+        while True:
+            message = await self.queue.get()
+            self._in_flight.add(message)
+            try:
+                await self._deliver(message)
+                self._in_flight.discard(message)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, message):
+        await self.bucket.acquire()
+        started = time.perf_counter()
+        try:
+            await self.send(message.user_id, message.text, message.random_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            message.attempts += 1
+            message.error = str(e)[:500]
+            permanent = getattr(e, "code", None) in PERMANENT_ERROR_CODES
+            if permanent or message.attempts >= self.max_attempts:
+                self.failed += 1
+                message.dead = True
+                print(f"Сообщение пользователю {message.user_id} не доставлено: {e}")
+                await self._persist([message])
+            else:
+                self._schedule_retry(message)
+            return
+
+        self._latencies.append(time.perf_counter() - started)
+        self.sent += 1
+        if message.stored_id is not None:
+            await self._forget(message.stored_id)
+            self._stored_ids.discard(message.stored_id)
+
+    def _schedule_retry(self, message):
+        # 0.5, 1, 2, 4 ... секунд со случайным разбросом, чтобы повторы не шли пачкой
+        delay = min(self.backoff_max, self.backoff * 2 ** (message.attempts - 1))
+        delay *= random.uniform(0.5, 1.5)
+        task = asyncio.create_task(self._retry_after(message, delay))
+        self._retries[task] = message
+        task.add_done_callback(lambda done: self._retries.pop(done, None))
+        self.retried += 1
+
+    async def _retry_after(self, message, delay):
+        await asyncio.sleep(delay)
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Строка остается в таблице - сохраняем попытки, ее заберет _poll
+            self.overflowed += 1
+            await self._persist([message])
+
+    async def _poll(self):
+        # Сообщения, сохраненные при переполнении очереди, отправляются,
+        # как только в ней освободится место, а не после перезапуска
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self._redeliver()
+
+    async def _redeliver(self):
+        """
+        Ставит в очередь сообщения из outbound_messages, которые еще можно доставить
+        (кроме dead и уже находящихся в памяти), сколько поместится в очередь
+        """
+        free = self.queue_size - self.queue.qsize()
+        if free <= 0:
+            return
+        held = list(self._stored_ids)
+        try:
+            async with async_session_scope(self.session_factory) as db:
+                query = select(OutboundMessage).where(OutboundMessage.dead.is_(False))
+                if held:
+                    query = query.where(OutboundMessage.id.notin_(held))
+                rows = (await db.execute(
+                    query.order_by(OutboundMessage.id).limit(free)
+                )).scalars().all()
+        except Exception as e:
+            print(f"Не удалось прочитать неотправленные сообщения: {e}")
+            return
+
+        queued = 0
+        for row in rows:
+            if row.id in self._stored_ids:
+                continue
+            # Счетчик попыток сохраняется: сообщение, которое не удается доставить
+            # и после перезапусков, в итоге помечается dead
+            message = OutgoingMessage(row.user_id, row.text, row.random_id,
+                                      attempts=row.attempts, stored_id=row.id)
+            if not self._enqueue_stored(message):
+                break
+            queued += 1
+        self.redelivered += queued
+        if queued:
+            print(f"Повторная отправка сохраненных сообщений: {queued}")
+
+    async def _persist(self, messages):
+        """
+        Сохраняет счетчик попыток, последнюю ошибку и пометку dead сообщений
+        Сохраненные сообщения больше не считаются находящимися в памяти:
+        их заберет _poll, если они не dead
+        """
+        try:
+            async with async_session_scope(self.session_factory) as db:
+                for message in messages:
+                    # attempts сообщения уже включает попытки до перезапуска
+                    await db.execute(
+                        update(OutboundMessage)
+                        .where(OutboundMessage.id == message.stored_id)
+                        .values(attempts=message.attempts, last_error=message.error,
+                                dead=message.dead))
+        except Exception as e:
+            print(f"Не удалось сохранить состояние неотправленных сообщений ({len(messages)}): {e}")
+        finally:
+            self._stored_ids.difference_update(message.stored_id for message in messages)
+
+    async def _forget(self, stored_id):
+        """Удаляет доставленное сообщение из outbound_messages"""
+        try:
+            async with async_session_scope(self.session_factory) as db:
+                await db.execute(delete(OutboundMessage).where(OutboundMessage.id == stored_id))
+        except Exception as e:
+            print(f"Не удалось удалить доставленное сообщение #{stored_id}: {e}")
@@ -0,0 +1,133 @@
+# Постраничный просмотр таблиц пользователей (id, name)
+#
+# Используется keyset-пагинация: следующая страница запрашивается как
+#     WHERE id > <последний ID страницы> ORDER BY id LIMIT n
+# а не через OFFSET. С OFFSET PostgreSQL вынужден прочитать и выбросить все
+# строки до нужной страницы, а здесь он сразу переходит к нужному месту по
+# индексу первичного ключа, поэтому сотая страница стоит столько же, сколько первая.
+from collections import namedtuple
+
+from psycopg2 import sql
+
+# Размер страницы по умолчанию
+DEFAULT_PAGE_SIZE = 20
+
+# Страница результата:
+# rows - список кортежей (id, name)
+# next_token / prev_token - токены для перехода на соседние страницы (или None)
+Page = namedtuple("Page", ["rows", "next_token", "prev_token"])
+
+
+def make_page_token(direction, user_id):
+    """
+    Формирует токен страницы
+    direction - "after" (строки с ID больше user_id) или "before" (строки с ID меньше)
+    """
+    return f"{direction}:{user_id}"
+
+
+def parse_page_token(token):
+    """
+    Разбирает токен страницы. None означает первую страницу.
+    Возвращает кортеж (direction, user_id)
+    """
+    if not token:
+        return "after", None
+    direction, _, user_id = token.partition(":")
+    if direction not in ("after", "before") or not user_id.isdigit():
+        raise ValueError(f"Некорректный токен страницы: {token!r}")
+    return direction, int(user_id)
+
+
+def fetch_users_page(conn, table_name, page_size=DEFAULT_PAGE_SIZE, token=None):
+    """
+    Получает одну страницу записей, упорядоченных по id
+    conn - активное подключение к базе данных
+    table_name - имя таблицы
+    page_size - количество записей на странице
+    token - токен страницы из предыдущего вызова (None - первая страница)
+    Возвращает Page
+    """
+    direction, boundary = parse_page_token(token)
+    table = sql.Identifier(table_name)
+
+    with conn.cursor() as cursor:
+        # Запрашиваем на одну строку больше, чтобы узнать,
+        # есть ли еще записи в направлении листания
+        if direction == "after":
+            if boundary is None:
+                cursor.execute(
+                    sql.SQL("SELECT id, name FROM {} ORDER BY id LIMIT %s;").format(table),
+                    (page_size + 1,))
+            else:
+                cursor.execute(
+                    sql.SQL("SELECT id, name FROM {} WHERE id > %s ORDER BY id LIMIT %s;")
+                    .format(table),
+                    (boundary, page_size + 1))
+            rows = cursor.fetchall()
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+            has_next, has_prev = has_more, boundary is not None
+        else:
+            # Предыдущая страница: идем по индексу в обратную сторону
+            # и разворачиваем результат
+            cursor.execute(
+                sql.SQL("SELECT id, name FROM {} WHERE id < %s ORDER BY id DESC LIMIT %s;")
+                .format(table),
+                (boundary, page_size + 1))
+            rows = cursor.fetchall()
+            has_more = len(rows) > page_size
+            rows = rows[:page_size][::-1]
+            has_next, has_prev = True, has_more
+
+    next_token = make_page_token("after", rows[-1][0]) if rows and has_next else None
+    prev_token = make_page_token("before", rows[0][0]) if rows and has_prev else None
+    return Page(rows, next_token, prev_token)
+
+
+def print_page(page):
+    """Выводит страницу в виде таблицы"""
+    print("+" + "-" * 23 + "+")
+    print("| {:^3} | {:^15} |".format("ID", "Имя"))
+    print("+" + "-" * 23 + "+")
+    for user in page.rows:
+        print("| {:^3} | {:<15} |".format(user[0], user[1]))
+    print("+" + "-" * 23 + "+")
+
+
+def browse_pages(conn, table_name, page_size=DEFAULT_PAGE_SIZE, token=None):
+    """
+    Интерактивный постраничный просмотр таблицы
+    Команды: n - следующая страница, p - предыдущая, q - выход
+    Возвращает токен последней показанной страницы, чтобы с нее можно было продолжить
+    """
+    current = token
+    while True:
+        page = fetch_users_page(conn, table_name, page_size, current)
+        # Транзакцию чтения не держим открытой, пока пользователь думает
+        conn.rollback()
+
+        if not page.rows:
+            print("Записей на этой странице нет")
+            return current
+
+        print(f"\nЗаписи с ID {page.rows[0][0]} по {page.rows[-1][0]}:")
+        print_page(page)
+
+        commands = []
+        if page.next_token:
+            commands.append("n - следующая")
+        if page.prev_token:
+            commands.append("p - предыдущая")
+        commands.append("q - выход")
+        choice = input(f"Страница ({', '.join(commands)}): ").strip().lower()
+
+        if choice == "n" and page.next_token:
+            current = page.next_token
+        elif choice == "p" and page.prev_token:
+            current = page.prev_token
+        elif choice == "q":
+            # Токен, с которого эту же страницу можно открыть снова
+            return make_page_token("after", page.rows[0][0] - 1)
+        else:
+            print("Неверная команда")
@@ -0,0 +1,177 @@
+# Параллельная загрузка большого файла с именами в таблицу
+#
+# Файл делится на куски фиксированного размера (по границам строк), и куски
+# загружаются через COPY несколькими процессами, у каждого свое соединение.
+# Загруженный кусок отмечается в таблице load_progress в той же транзакции,
+# что и его COPY, поэтому после сбоя повторный запуск с теми же параметрами
+# загружает только незавершенные куски и ни один кусок не попадает в таблицу дважды.
+#
+# Пример:
+#     python parallel_load.py names.txt --table users --jobs 8 --chunk-mb 16
+import argparse
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+import psycopg2
+
+import db_pool
+from main import copy_names, create_table_if_not_exists
+from schema_cache import ensure_schema
+
+# Версия DDL таблицы прогресса загрузки
+PROGRESS_SCHEMA_VERSION = 1
+
+
+def create_progress_table(conn):
+    """Создает таблицу с отметками о загруженных кусках, если её нет."""
+    def create():
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS load_progress (
+                    job VARCHAR(64) NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    rows INTEGER NOT NULL,
+                    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (job, chunk)
+                );
+            """)
+        conn.commit()
+
+    ensure_schema(conn, "load_progress", PROGRESS_SCHEMA_VERSION, create)
+
+
+def make_job_id(path, table_name, chunk_size):
+    """
+    Идентификатор загрузки: один и тот же для одного и того же файла,
+    таблицы и размера куска, чтобы повторный запуск продолжил прерванный.
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{table_name}|{chunk_size}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def plan_chunks(path, chunk_size):
+    """Делит файл на куски [start, end) по chunk_size байт."""
+    size = os.path.getsize(path)
+    return [(number, start, min(start + chunk_size, size))
+            for number, start in enumerate(range(0, size, chunk_size))]
+
+
+def read_chunk(path, start, end):
+    """
+    Читает имена из куска файла.
+    Куску принадлежат строки, первый байт которых лежит в [start, end):
+    строка, начатая в предыдущем куске, пропускается, а последняя строка
+    дочитывается до конца, даже если выходит за end.
+    """
+    with open(path, "rb") as source:
+        if start > 0:
+            source.seek(start - 1)
+            source.readline()
+        while source.tell() < end:
+            line = source.readline()
+            if not line:
+                break
+            name = line.decode("utf-8").strip()
+            if name:
+                yield name
+
+
+def load_chunk(task):
+    """
+    Загружает один кусок в отдельном процессе.
+    Возвращает (номер куска, строк, секунд, текст ошибки или None).
+    """
+    path, table_name, job, number, start, end = task
+    started = time.perf_counter()
+    try:
+        with db_pool.connection() as conn:
+            count, _ = copy_names(conn, table_name, read_chunk(path, start, end),
+                                  commit=False)
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "INSERT INTO load_progress (job, chunk, rows) VALUES (%s, %s, %s);",
+                    (job, number, count))
+            conn.commit()
+        return number, count, time.perf_counter() - started, None
+    except (psycopg2.Error, OSError, UnicodeDecodeError) as e:
+        return number, 0, time.perf_counter() - started, str(e)
+
+
+def loaded_chunks(conn, job):
+    """Номера кусков, уже загруженных в рамках этой загрузки."""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT chunk FROM load_progress WHERE job = %s;", (job,))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Параллельная загрузка имен через COPY")
+    parser.add_argument("path", help="файл с именами, по одному на строку")
+    parser.add_argument("--table", required=True, help="имя таблицы")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count() or 1,
+                        help="число процессов-загрузчиков (по умолчанию - число ядер)")
+    parser.add_argument("--chunk-mb", type=float, default=16,
+                        help="размер куска файла в мегабайтах")
+    parser.add_argument("--job-id", help="идентификатор загрузки для продолжения "
+                                         "(по умолчанию вычисляется из файла и параметров)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    chunk_size = max(1, int(args.chunk_mb * 1024 * 1024))
+    job = args.job_id or make_job_id(args.path, args.table, chunk_size)
+    chunks = plan_chunks(args.path, chunk_size)
+
+    # Подготовка выполняется в основном процессе, до запуска загрузчиков
+    try:
+        with db_pool.connection() as conn:
+            create_table_if_not_exists(conn, args.table)
+            create_progress_table(conn)
+            done = loaded_chunks(conn, job)
+    except psycopg2.Error as e:
+        print(f"Ошибка: {e}")
+        sys.exit(1)
+    finally:
+        # Дочерним процессам соединения родителя не нужны
+        db_pool.close_pool()
+
+    tasks = [(args.path, args.table, job, number, start, end)
+             for number, start, end in chunks if number not in done]
+    print(f"Загрузка {job}: кусков {len(chunks)}, уже загружено {len(done)}, "
+          f"осталось {len(tasks)}, процессов {args.jobs}")
+
+    started = time.perf_counter()
+    total_rows = 0
+    failed = []
+    # spawn: каждый процесс стартует с чистого интерпретатора и открывает
+    # свои соединения (и так же работает на Windows)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=args.jobs) as pool:
+        for finished, (number, rows, seconds, error) in enumerate(
+                pool.imap_unordered(load_chunk, tasks), start=1):
+            if error:
+                failed.append(number)
+                print(f"[{finished}/{len(tasks)}] кусок #{number}: ошибка: {error}")
+                continue
+            total_rows += rows
+            elapsed = time.perf_counter() - started
+            rate = total_rows / elapsed if elapsed > 0 else 0
+            print(f"[{finished}/{len(tasks)}] кусок #{number}: {rows} строк за {seconds:.2f} с, "
+                  f"всего {total_rows} строк, {rate:.0f} строк/с")
+
+    elapsed = time.perf_counter() - started
+    rate = total_rows / elapsed if elapsed > 0 else 0
+    print(f"Загружено строк: {total_rows} за {elapsed:.2f} с ({rate:.0f} строк/с)")
+    if failed:
+        print(f"Не загружены куски: {', '.join(map(str, sorted(failed)))}. "
+              f"Повторите запуск с теми же параметрами, чтобы догрузить только их.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Реестр подготовленных запросов (PREPARE / EXECUTE) для psycopg2
+#
+# Обычный cursor.execute() каждый раз отправляет серверу полный текст запроса,
+# и PostgreSQL заново его разбирает и планирует. Подготовленный запрос
+# разбирается один раз на соединение командой PREPARE, а дальше выполняется
+# короткой командой EXECUTE имя (параметры).
+import re
+import weakref
+
+from psycopg2 import errors
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+# Параметры в тексте запроса записываются в стиле PostgreSQL: $1, $2, ...
+_PARAM = re.compile(r"\$(\d+)")
+
+
+class StatementRegistry:
+    """
+    Набор именованных запросов, которые готовятся (PREPARE) один раз
+    на каждое соединение и затем выполняются через EXECUTE.
+
+    statements - словарь {имя: текст запроса с параметрами $1, $2, ...}
+    enabled - если False, запросы выполняются обычным cursor.execute()
+    """
+
+    def __init__(self, statements, enabled=True):
+        self.statements = statements
+        self.enabled = enabled
+        # соединение -> (PID серверного процесса, множество подготовленных имен).
+        # Слабые ссылки: закрытые и выброшенные пулом соединения не накапливаются
+        self._prepared = weakref.WeakKeyDictionary()
+
+    def execute(self, cursor, name, params=()):
+        """Выполняет запрос name с параметрами params на курсоре cursor"""
+        if not self.enabled:
+            self._execute_plain(cursor, name, params)
+            return
+
+        conn = cursor.connection
+        # Если транзакция еще не начата, после ошибки ее можно безопасно
+        # откатить и повторить запрос
+        at_transaction_start = conn.info.transaction_status == TRANSACTION_STATUS_IDLE
+        self._ensure_prepared(cursor, name)
+        try:
+            self._execute_prepared(cursor, name, params)
+        except errors.InvalidSqlStatementName:
+            # Сервер забыл подготовленный запрос (например, после DISCARD ALL)
+            self.forget(conn)
+            if not at_transaction_start:
+                raise
+            conn.rollback()
+            self._ensure_prepared(cursor, name)
+            self._execute_prepared(cursor, name, params)
+
+    def forget(self, conn):
+        """Сбрасывает сведения о подготовленных запросах соединения"""
+        self._prepared.pop(conn, None)
+
+    def _ensure_prepared(self, cursor, name):
+        conn = cursor.connection
+        # PID меняется, если под тем же объектом оказалось новое
+        # серверное соединение - тогда все запросы нужно подготовить заново
+        pid = conn.get_backend_pid()
+        state = self._prepared.get(conn)
+        if state is None or state[0] != pid:
+            state = (pid, set())
+            self._prepared[conn] = state
+        if name not in state[1]:
+            # PREPARE не откатывается вместе с транзакцией,
+            # поэтому запрос остается подготовленным до закрытия соединения
+            cursor.execute(f"PREPARE {name} AS {self.statements[name]}")
+            state[1].add(name)
+
+    def _execute_prepared(self, cursor, name, params):
+        if params:
+            placeholders = ", ".join(["%s"] * len(params))
+            cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+        else:
+            cursor.execute(f"EXECUTE {name}")
+
+    def _execute_plain(self, cursor, name, params):
+        # $1, $2, ... превращаются в %s, а параметры выстраиваются
+        # в порядке их появления в тексте (один $n может встречаться несколько раз)
+        query = self.statements[name]
+        order = [int(number) - 1 for number in _PARAM.findall(query)]
+        cursor.execute(_PARAM.sub("%s", query), [params[i] for i in order])
@@ -1,14 +1,16 @@
+# Модули стандартной библиотеки для разбора аргументов и CSV-файлов
+import argparse
+import csv
+import io
+import time
+
 # Импортируем библиотеку для работы с PostgreSQL
 import psycopg2
 # Импортируем модуль sql для безопасного формирования SQL-запросов
 from psycopg2 import sql
 
-# Настройки подключения к базе данных (замените на свои реальные данные)
-DB_NAME = ""  # Имя вашей БД
-DB_USER = "postgres"       # Пользователь (обычно postgres)
-DB_PASSWORD = ""  # Пароль, который вы задали при установке
-DB_HOST = "localhost"      # Хост (обычно localhost)
-DB_PORT = "5432"           # Порт (обычно 5432)
+# Общий пул соединений (настройки подключения - в файле .env)
+import db_pool
 
 
 def get_user_by_id(conn, table_name, user_id):
@@ -34,42 +36,182 @@ def get_user_by_id(conn, table_name, user_id):
         return result[0] if result else None
 
 
-def update_user_name(conn, table_name, user_id, new_name):
+def update_user_name(conn, table_name, user_id, new_name, expected_name=None):
     """
-    Функция для обновления имени пользователя
+    Функция для обновления имени пользователя одним запросом
     conn - подключение к базе данных
     table_name - имя таблицы
     user_id - ID пользователя
     new_name - новое имя для установки
+    expected_name - если указано, имя меняется только если в базе все еще
+                    это значение (защита от потери чужой правки)
+    Возвращает None, если пользователь не найден, иначе кортеж
+    (имя до изменения, было ли имя обновлено)
     """
     with conn.cursor() as cursor:
-        # Формируем UPDATE-запрос для изменения имени
+        # Один запрос и читает старое имя, и обновляет строку:
+        # CTE old блокирует строку и запоминает текущее имя,
+        # CTE updated меняет имя (с проверкой expected_name, если она задана)
         cursor.execute(
-            sql.SQL("UPDATE {} SET name = %s WHERE id = %s;")
-            .format(sql.Identifier(table_name)),
-            (new_name, user_id)  # Подставляем параметры
+            sql.SQL("""
+                WITH old AS (
+                    SELECT id, name FROM {table} WHERE id = %(id)s FOR UPDATE
+                ), updated AS (
+                    UPDATE {table} AS u
+                    SET name = %(new_name)s
+                    FROM old
+                    WHERE u.id = old.id
+                      AND (%(expected)s::varchar IS NULL OR old.name = %(expected)s)
+                    RETURNING u.id
+                )
+                SELECT old.name, EXISTS (SELECT 1 FROM updated) FROM old;
+            """).format(table=sql.Identifier(table_name)),
+            {"id": user_id, "new_name": new_name, "expected": expected_name}
         )
+        result = cursor.fetchone()
         # Подтверждаем изменения в базе данных
         conn.commit()
-        print(f"Имя пользователя с ID {user_id} обновлено на '{new_name}'.")
+
+    if result is None:
+        print(f"Пользователь с ID {user_id} не найден.")
+        return None
+
+    old_name, updated = result
+    if updated:
+        print(f"Имя пользователя с ID {user_id} обновлено с '{old_name}' на '{new_name}'.")
+    else:
+        print(f"Имя пользователя с ID {user_id} уже изменили на '{old_name}', "
+              f"правка не применена.")
+    return old_name, updated
+
+
+def read_renames(path):
+    """
+    Функция для чтения CSV-файла с правками в формате id,new_name
+    path - путь к файлу
+    Первая строка пропускается, если это заголовок (ID не число).
+    Если один ID встречается несколько раз, побеждает последняя правка.
+    Возвращает словарь {id: new_name}
+    """
+    changes = {}
+    with open(path, newline="", encoding="utf-8") as file:
+        for line_no, row in enumerate(csv.reader(file), start=1):
+            # Пустые строки пропускаем
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            user_id = row[0].strip()
+            if not user_id.isdigit():
+                if line_no == 1:
+                    continue  # Заголовок
+                raise ValueError(f"Строка {line_no}: ID должен быть числом")
+            if len(row) < 2 or not row[1].strip():
+                raise ValueError(f"Строка {line_no}: не указано новое имя")
+            changes[int(user_id)] = row[1].strip()
+    return changes
+
+
+def bulk_rename(conn, table_name, changes):
+    """
+    Функция для массового переименования одной транзакцией
+    conn - подключение к базе данных
+    table_name - имя таблицы
+    changes - словарь {id: new_name}
+    Правки загружаются во временную таблицу одним COPY и применяются
+    одним UPDATE ... FROM, поэтому время не зависит от задержки сети на каждую строку.
+    Возвращает кортеж (список (id, старое имя, новое имя), список ненайденных ID)
+    """
+    # Готовим CSV в памяти для COPY
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(changes.items())
+    buffer.seek(0)
+
+    try:
+        with conn.cursor() as cursor:
+            # Временная таблица живет только до конца транзакции
+            cursor.execute("""
+                CREATE TEMP TABLE bulk_renames (
+                    id INTEGER PRIMARY KEY,
+                    new_name VARCHAR(100) NOT NULL
+                ) ON COMMIT DROP;
+            """)
+            cursor.copy_expert(
+                "COPY bulk_renames (id, new_name) FROM STDIN WITH (FORMAT csv);", buffer)
+            # Статистика нужна планировщику, чтобы выбрать соединение хешированием
+            cursor.execute("ANALYZE bulk_renames;")
+
+            # Второй экземпляр таблицы (old) видит строки до изменения,
+            # поэтому старое имя возвращается тем же запросом
+            cursor.execute(
+                sql.SQL("""
+                    UPDATE {table} AS u
+                    SET name = r.new_name
+                    FROM bulk_renames AS r
+                    JOIN {table} AS old ON old.id = r.id
+                    WHERE u.id = r.id
+                    RETURNING u.id, old.name, u.name;
+                """).format(table=sql.Identifier(table_name)))
+            renamed = sorted(cursor.fetchall())
+        # Все правки фиксируются одним коммитом
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+
+    # ID, которые не вернул UPDATE, в таблице отсутствуют
+    found = {row[0] for row in renamed}
+    missing = sorted(user_id for user_id in changes if user_id not in found)
+    return renamed, missing
+
+
+def run_bulk_rename(conn, table_name, path):
+    """
+    Функция для режима массового переименования из CSV-файла
+    Печатает изменения в виде "старое -> новое" и список ненайденных ID
+    """
+    changes = read_renames(path)
+    started = time.perf_counter()
+    renamed, missing = bulk_rename(conn, table_name, changes)
+    elapsed = time.perf_counter() - started
+
+    for user_id, old_name, new_name in renamed:
+        print(f"ID {user_id}: '{old_name}' -> '{new_name}'")
+    if missing:
+        print(f"Не найдены ID ({len(missing)}): {', '.join(map(str, missing))}")
+    print(f"Обновлено {len(renamed)} из {len(changes)} записей за {elapsed:.2f} с")
+
+
+def parse_args():
+    """Функция для разбора аргументов командной строки"""
+    parser = argparse.ArgumentParser(description="Редактирование имен пользователей")
+    parser.add_argument("--table", help="имя таблицы (если не указано, будет запрошено)")
+    parser.add_argument("--bulk", metavar="CSV",
+                        help="применить правки из CSV-файла id,new_name одной транзакцией")
+    return parser.parse_args()
 
 
 def main():
-    # Инициализируем переменную для подключения
-    conn = None
+    # Разбираем аргументы командной строки
+    args = parse_args()
+
     try:
-        # Устанавливаем соединение с базой данных
-        conn = psycopg2.connect(
-            dbname=DB_NAME,  # Имя базы данных
-            user=DB_USER,  # Имя пользователя
-            password=DB_PASSWORD,  # Пароль
-            host=DB_HOST,  # Адрес сервера
-            port=DB_PORT  # Порт
-        )
+        # Создаем пул соединений; соединение берется из него только на время
+        # запроса и не занято, пока программа ждет ввода
+        db_pool.get_pool()
         print("Успешное подключение к PostgreSQL!")
 
         # Запрашиваем у пользователя имя таблицы для работы
-        table_name = input("Введите имя таблицы: ").strip()
+        table_name = args.table or input("Введите имя таблицы: ").strip()
+
+        # Массовый режим: все правки из файла за одну транзакцию
+        if args.bulk:
+            try:
+                with db_pool.connection() as conn:
+                    run_bulk_rename(conn, table_name, args.bulk)
+            except (OSError, ValueError) as e:  # Ошибки чтения файла
+                print(f"Ошибка в файле правок: {e}")
+            except psycopg2.Error as e:  # Ошибки PostgreSQL
+                print(f"Ошибка базы данных: {e}")
+            return
 
         # Основной цикл программы
         while True:
@@ -84,8 +226,10 @@ def main():
                 # Преобразуем введенный ID в число
                 user_id = int(user_id)
 
-                # Получаем имя пользователя по ID
-                name = get_user_by_id(conn, table_name, user_id)
+                # Получаем имя пользователя по ID; при возврате соединения
+                # в пул транзакция чтения завершается
+                with db_pool.connection() as conn:
+                    name = get_user_by_id(conn, table_name, user_id)
 
                 # Если пользователь не найден
                 if name is None:
@@ -100,8 +244,10 @@ def main():
                 if choice == 'yes':
                     # Запрашиваем новое имя
                     new_name = input("Введите новое имя: ").strip()
-                    # Обновляем имя в базе данных
-                    update_user_name(conn, table_name, user_id, new_name)
+                    # Обновляем имя в базе данных, только если его никто
+                    # не изменил с момента, когда мы его показали
+                    with db_pool.connection() as conn:
+                        update_user_name(conn, table_name, user_id, new_name, expected_name=name)
                 else:
                     print("Редактирование отменено.")
 
@@ -113,10 +259,10 @@ def main():
                 print(f"Неизвестная ошибка: {e}")
 
     finally:
-        # Этот блок выполнится в любом случае, даже если возникла ошибка
-        if conn:  # Если подключение было установлено
-            conn.close()  # Закрываем подключение
-            print("\nСоединение с базой данных закрыто.")
+        # Этот блок выполнится в любом случае, даже если возникла ошибка:
+        # закрываем все соединения пула
+        db_pool.close_pool()
+        print("\nСоединение с базой данных закрыто.")
 
 
 # Стандартная проверка для запуска программы
@@ -0,0 +1,101 @@
+# Кэш состояния схемы: DDL выполняется, только если таблица еще не проверена
+#
+# CREATE TABLE IF NOT EXISTS и Base.metadata.create_all() на каждом запуске
+# обращаются к системному каталогу и берут блокировки, даже когда таблица
+# давно существует. Здесь проверенные таблицы запоминаются:
+# - на время жизни процесса - всегда;
+# - между запусками - в служебной таблице schema_versions, если задана
+#   переменная окружения SCHEMA_CACHE_PERSIST=1. Тогда при старте выполняется
+#   один простой SELECT по первичному ключу, а DDL - только при смене версии.
+import os
+import threading
+
+from psycopg2 import errors
+
+PERSIST = os.getenv("SCHEMA_CACHE_PERSIST", "0") == "1"
+
+# Пары (имя, версия), проверенные в этом процессе
+_verified = set()
+_lock = threading.Lock()
+
+
+def ensure_schema(conn, name, version, create, persist=PERSIST):
+    """
+    Выполняет create(), только если схема name версии version еще не проверена
+    conn - DB-API соединение (psycopg2 или engine.raw_connection() SQLAlchemy);
+           вызывать в начале транзакции - функция сама ее фиксирует
+    name - имя объекта схемы, обычно имя таблицы
+    version - версия DDL; увеличьте ее, когда меняете определение таблицы
+    create - функция без аргументов, которая выполняет DDL
+    persist - хранить ли версию в таблице schema_versions между запусками
+    Возвращает True, если DDL выполнялся
+    """
+    with _lock:
+        if (name, version) in _verified:
+            return False
+
+    if persist and _stored_version(conn, name) == version:
+        with _lock:
+            _verified.add((name, version))
+        return False
+
+    create()
+    if persist:
+        _store_version(conn, name, version)
+
+    with _lock:
+        _verified.add((name, version))
+    return True
+
+
+def is_verified(name, version):
+    """
+    Проверена ли схема name версии version в этом процессе
+    Позволяет не брать соединение из пула, если ensure_schema ничего не сделает
+    """
+    with _lock:
+        return (name, version) in _verified
+
+
+def forget(name=None):
+    """Сбрасывает кэш процесса для одной таблицы или целиком"""
+    with _lock:
+        if name is None:
+            _verified.clear()
+        else:
+            _verified.difference_update({item for item in _verified if item[0] == name})
+
+
+def _stored_version(conn, name):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT version FROM schema_versions WHERE name = %s;", (name,))
+        row = cursor.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    except errors.UndefinedTable:
+        # Служебной таблицы еще нет - значит, ничего не проверялось
+        conn.rollback()
+        return None
+    finally:
+        cursor.close()
+
+
+def _store_version(conn, name, version):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_versions (
+                name VARCHAR(100) PRIMARY KEY,
+                version INTEGER NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        cursor.execute("""
+            INSERT INTO schema_versions (name, version) VALUES (%s, %s)
+            ON CONFLICT (name) DO UPDATE
+            SET version = EXCLUDED.version, updated_at = now();
+        """, (name, version))
+        conn.commit()
+    finally:
+        cursor.close()
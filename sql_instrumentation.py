@@ -0,0 +1,280 @@
+# Инструментирование SQL-запросов SQLAlchemy
+#
+# Подписывается на события before_cursor_execute / after_cursor_execute движка
+# (и handle_error - после ошибки запроса after_cursor_execute не вызывается) и
+# для каждого нормализованного запроса (литералы и параметры заменены на ?)
+# собирает гистограмму времени выполнения и число строк. Запросы дольше порога
+# пишутся в журнал медленных запросов (logger "sql.slow"), при желании вместе
+# с планом EXPLAIN. Результаты можно выгрузить в JSON.
+#
+# Включается переменными окружения (для движков из db_engine.py):
+#   SQL_STATS=1 - собирать статистику
+#   SQL_SLOW_MS - порог медленного запроса в миллисекундах (по умолчанию 200)
+#   SQL_EXPLAIN_SLOW=1 - добавлять к медленным SELECT план EXPLAIN (без выполнения запроса)
+#   SQL_EXPLAIN_ANALYZE=1 - снимать план через EXPLAIN (ANALYZE, BUFFERS). Запрос при этом
+#       выполняется повторно: SELECT ... FOR UPDATE/SHARE пропускаются (повторно
+#       взятые блокировки держались бы до конца транзакции), а изменения данных
+#       откатываются до SAVEPOINT, но вызовы nextval() и других volatile-функций
+#       с внешними эффектами (dblink, уведомления) выполнятся второй раз
+#   SQL_STATS_FILE - файл, в который статистика сохраняется при выходе из программы
+import atexit
+import json
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+
+from sqlalchemy import event
+
+# Верхние границы корзин гистограммы, мс; последняя корзина - "больше 5000"
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+slow_log = logging.getLogger("sql.slow")
+log = logging.getLogger("sql.instrumentation")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PARAM = re.compile(r"%\(\w+\)s|%s|\$\d+|\?")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+_LOCKING = re.compile(r"\bFOR\s+(?:NO\s+KEY\s+UPDATE|UPDATE|KEY\s+SHARE|SHARE)\b", re.IGNORECASE)
+
+
+def normalize_statement(statement):
+    """
+    Приводит запрос к общему виду, чтобы запросы, отличающиеся только
+    значениями, попадали в одну строку статистики
+    """
+    text = _STRING.sub("?", statement)
+    text = _PARAM.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("(?, ...)", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+class StatementStats:
+    """Накопленная статистика одного нормализованного запроса"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms, rows, slow):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += max(rows, 0)
+        self.slow += slow
+        for index, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def to_dict(self):
+        labels = [f"<={bound}ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}ms"]
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ms, 3),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "slow": self.slow,
+            "histogram": {label: n for label, n in zip(labels, self.buckets) if n},
+        }
+
+
+class SqlInstrumentation:
+    """
+    Сборщик статистики SQL для одного или нескольких движков
+    slow_ms - порог медленного запроса, мс
+    explain_slow - снимать ли план EXPLAIN для медленных SELECT (только через psycopg2)
+    explain_analyze - снимать план через EXPLAIN (ANALYZE, BUFFERS): запрос выполняется
+                      еще раз, поэтому SELECT с FOR UPDATE/SHARE получают план без ANALYZE
+    """
+
+    def __init__(self, slow_ms=200.0, explain_slow=False, explain_analyze=False):
+        self.slow_ms = slow_ms
+        self.explain_slow = explain_slow
+        self.explain_analyze = explain_analyze
+        self.statements = {}  # нормализованный запрос -> StatementStats
+        self.slow_queries = []  # последние медленные запросы
+        self.max_slow_queries = 100
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Добавляет обработчик hook(record), который вызывается после каждого запроса
+        record - словарь с ключами statement, normalized, elapsed_ms, rows, slow
+        Исключение в обработчике записывается в журнал и не прерывает запрос приложения
+        """
+        self._hooks.append(hook)
+
+    def attach(self, engine):
+        """Подписывается на события движка (синхронного или асинхронного)"""
+        engine = getattr(engine, "sync_engine", engine)
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        event.listen(engine, "handle_error", self._error)
+        _instances[engine] = self
+
+    def reset(self):
+        """Обнуляет накопленную статистику"""
+        with self._lock:
+            self.statements.clear()
+            self.slow_queries.clear()
+
+    def to_dict(self):
+        """Статистика в виде словаря; запросы отсортированы по суммарному времени"""
+        with self._lock:
+            ordered = sorted(self.statements.items(),
+                             key=lambda item: item[1].total_ms, reverse=True)
+            return {
+                "slow_ms": self.slow_ms,
+                "statements": [dict(statement=statement, **stats.to_dict())
+                               for statement, stats in ordered],
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def dump_json(self, path):
+        """Сохраняет статистику в JSON-файл"""
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_dict(), file, ensure_ascii=False, indent=2)
+
+    def print_summary(self, top=10):
+        """Выводит запросы, которые заняли больше всего времени"""
+        statements = self.to_dict()["statements"][:top]
+        if not statements:
+            print("Статистика SQL пока пуста")
+            return
+        print("\nСамые затратные запросы (всего времени, мс / вызовов / среднее, мс):")
+        for item in statements:
+            print(f"{item['total_ms']:>10.1f} / {item['count']:>6} / {item['avg_ms']:>8.2f}  "
+                  f"{item['statement'][:100]}")
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        # Стек, а не одно значение: запрос может выполниться внутри другого
+        # (например, EXPLAIN или события пула)
+        conn.info.setdefault("sql_instrumentation_start", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("sql_instrumentation_start")
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        rows = cursor.rowcount if cursor.rowcount is not None else -1
+        normalized = normalize_statement(statement)
+        slow = elapsed_ms >= self.slow_ms
+
+        with self._lock:
+            stats = self.statements.get(normalized)
+            if stats is None:
+                stats = self.statements[normalized] = StatementStats()
+            stats.add(elapsed_ms, rows, slow)
+
+        if slow:
+            self._log_slow(conn, cursor, statement, parameters, executemany,
+                           normalized, elapsed_ms, rows)
+
+        record = {"statement": statement, "normalized": normalized,
+                  "elapsed_ms": elapsed_ms, "rows": rows, "slow": slow}
+        for hook in self._hooks:
+            try:
+                hook(record)
+            except Exception:
+                log.exception("Ошибка в обработчике статистики SQL %r", hook)
+
+    def _error(self, context):
+        # Запрос завершился ошибкой: after_cursor_execute не будет, и время начала
+        # нужно убрать, иначе следующий _after возьмет его вместо своего
+        conn = context.connection
+        if conn is None:
+            return
+        starts = conn.info.get("sql_instrumentation_start")
+        if starts:
+            starts.pop()
+
+    def _log_slow(self, conn, cursor, statement, parameters, executemany,
+                  normalized, elapsed_ms, rows):
+        plan = None
+        if (self.explain_slow and not executemany
+                and conn.dialect.driver == "psycopg2"
+                and normalized.lstrip("( ").upper().startswith("SELECT")):
+            # Повторное выполнение SELECT ... FOR UPDATE взяло бы блокировки еще раз
+            analyze = self.explain_analyze and not _LOCKING.search(normalized)
+            plan = _explain(cursor.connection, statement, parameters, analyze)
+
+        entry = {"statement": normalized, "elapsed_ms": round(elapsed_ms, 3),
+                 "rows": rows, "at": time.time()}
+        if plan:
+            entry["plan"] = plan
+        with self._lock:
+            self.slow_queries.append(entry)
+            del self.slow_queries[:-self.max_slow_queries]
+
+        slow_log.warning("Медленный запрос %.1f мс, строк %s: %s%s",
+                         elapsed_ms, rows, normalized,
+                         f"\n{plan}" if plan else "")
+
+
+def _explain(dbapi_connection, statement, parameters, analyze=False):
+    """
+    Снимает план EXPLAIN (с analyze - EXPLAIN (ANALYZE, BUFFERS)) отдельным
+    курсором psycopg2. Выполняется внутри SAVEPOINT, который затем всегда
+    откатывается: ошибка EXPLAIN не прерывает транзакцию приложения, а
+    изменения, сделанные повторным выполнением запроса, не сохраняются
+    """
+    explain = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT sql_instrumentation_explain")
+        try:
+            cursor.execute(explain + statement, parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception as e:
+            plan = f"EXPLAIN не выполнен: {e}"
+        cursor.execute("ROLLBACK TO SAVEPOINT sql_instrumentation_explain")
+        cursor.execute("RELEASE SAVEPOINT sql_instrumentation_explain")
+        return plan
+    except Exception:
+        # SAVEPOINT недоступен (например, соединение в режиме autocommit)
+        return None
+    finally:
+        cursor.close()
+
+
+# Движок -> SqlInstrumentation (слабые ссылки, чтобы не удерживать движки)
+_instances = weakref.WeakKeyDictionary()
+
+
+def get_instrumentation(engine):
+    """Возвращает сборщик статистики, подключенный к движку, или None"""
+    return _instances.get(getattr(engine, "sync_engine", engine))
+
+
+def instrument_from_env(engine):
+    """
+    Подключает сборщик статистики к движку, если задано SQL_STATS=1
+    Возвращает SqlInstrumentation или None
+    """
+    if os.getenv("SQL_STATS", "0") != "1":
+        return None
+    instrumentation = SqlInstrumentation(
+        slow_ms=float(os.getenv("SQL_SLOW_MS", "200")),
+        explain_slow=os.getenv("SQL_EXPLAIN_SLOW", "0") == "1",
+        explain_analyze=os.getenv("SQL_EXPLAIN_ANALYZE", "0") == "1",
+    )
+    instrumentation.attach(engine)
+
+    path = os.getenv("SQL_STATS_FILE")
+    if path:
+        atexit.register(instrumentation.dump_json, path)
+    return instrumentation
@@ -0,0 +1,50 @@
+# Проверка массовых операций allin_alchemy на SQLite в памяти
+#
+#     python -m pytest -q test_allin_alchemy.py
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("dotenv")
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import allin_alchemy
+from allin_alchemy import Base, User, bulk_delete_users
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    session.add_all(User(id=user_id, name=f"user{user_id}") for user_id in range(1, 11))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def remaining_ids(session):
+    return session.scalars(select(User.id).order_by(User.id)).all()
+
+
+def test_bulk_delete_range(session):
+    # Объект в identity map должен исчезнуть из сессии вместе со строкой
+    loaded = session.get(User, 5)
+    assert bulk_delete_users(session, id_range=(3, 6)) == 4
+    assert remaining_ids(session) == [1, 2, 7, 8, 9, 10]
+    assert loaded not in session
+
+
+def test_bulk_delete_ids_and_range(session):
+    assert bulk_delete_users(session, ids=[1, 10], id_range=(4, 5), batch_size=1) == 4
+    assert remaining_ids(session) == [2, 3, 6, 7, 8, 9]
+
+
+def test_bulk_delete_range_invalidates_cache(session, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(allin_alchemy.user_cache, "invalidate_where",
+                        lambda predicate: invalidated.extend(k for k in range(1, 11) if predicate(k)))
+    bulk_delete_users(session, id_range=(8, 9))
+    assert invalidated == [8, 9]
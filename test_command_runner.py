@@ -0,0 +1,74 @@
+# Проверка пакетного режима command_runner.py на бэкенде в памяти
+#
+#     python -m pytest -q test_command_runner.py
+import io
+import json
+
+from command_runner import run_commands
+
+
+class MemoryBackend:
+    """Бэкенд без базы данных: изменения группы применяются при commit()"""
+
+    errors = (KeyError,)
+
+    def __init__(self, users):
+        self.users = dict(users)
+        self.changes = {}
+
+    def add(self, name):
+        user_id = max([*self.users, *self.changes, 0]) + 1
+        self.changes[user_id] = name
+        return {"id": user_id}
+
+    def delete(self, user_id):
+        self.users[user_id]
+        self.changes[user_id] = None
+        return {"deleted": True}
+
+    def update(self, user_id, name):
+        old_name = self.users[user_id]
+        self.changes[user_id] = name
+        return {"found": True, "old_name": old_name}
+
+    def find(self, user_id):
+        name = self.users.get(user_id)
+        return {"user": [user_id, name] if name else None}
+
+    def list(self):
+        return iter(sorted(self.users.items()))
+
+    def commit(self):
+        for user_id, name in self.changes.items():
+            if name is None:
+                self.users.pop(user_id, None)
+            else:
+                self.users[user_id] = name
+        self.changes.clear()
+
+    def rollback(self):
+        self.changes.clear()
+
+
+def run(script, users=()):
+    out = io.StringIO()
+    summary = run_commands(script.splitlines(), MemoryBackend(users), out=out)
+    return [json.loads(line) for line in out.getvalue().splitlines()], summary
+
+
+def test_list_emits_one_line_per_user():
+    records, _ = run("list\nlist 1", users={2: "Bob", 1: "Alice"})
+
+    assert [record["result"] for record in records[:-1]] == [
+        {"user": [1, "Alice"]}, {"user": [2, "Bob"]}, {"count": 2},
+        {"user": [1, "Alice"]}, {"count": 1},
+    ]
+
+
+def test_results_follow_command_order():
+    records, summary = run("add Alice\nbogus\nadd Bob\nfind 1")
+
+    assert [record["line"] for record in records[:-1]] == [1, 2, 3, 4]
+    assert records[1]["ok"] is False
+    assert records[3]["result"] == {"user": [1, "Alice"]}
+    assert summary["failed"] == 1
@@ -0,0 +1,15 @@
+# Проверка, что модели бота импортируются и объявляют нужные индексы
+#
+#     python -m pytest -q test_models.py
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+
+def test_models_import():
+    from models import Appeal, Manager, OutboundMessage
+
+    assert OutboundMessage.__tablename__ == "outbound_messages"
+    assert {index.name for index in Appeal.__table__.indexes} == {"ix_appeals_student_id_status"}
+    assert {index.name for index in Manager.__table__.indexes} == {"ix_managers_topic",
+                                                                  "ux_managers_vk_id"}